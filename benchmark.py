@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark pgMemento against a local PostgreSQL.
+
+Write overhead of the triggers, logging off and on:
+
+    ./benchmark.py writes --rows 1000 --repeat 3 --output bench_output.txt
+
+Read paths at growing log sizes, filled with synthetic history:
+
+    ./benchmark.py reads --sizes 100000,1000000,10000000 --output bench_output.txt
+"""
+import argparse
+import json
+import os
+import sys
+
+import django
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('suite', nargs='?', choices=['writes', 'reads'], default='writes')
+    parser.add_argument('--rows', type=int, default=500, help='rows written per write scenario')
+    parser.add_argument('--sizes', default='100000,1000000', help='comma separated row log counts to read at')
+    parser.add_argument('--skew', type=float, default=3.0, help='hot object skew of the generated history')
+    parser.add_argument('--m2m', type=float, default=0.2, help='share of generated history from m2m changes')
+    parser.add_argument('--repeat', type=int, default=None, help='runs of every scenario')
+    parser.add_argument('--scenario', default=None, help='only run scenarios whose name contains this')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'test_app.settings'
+    django.setup()
+
+    from test_app.tests import CerebrumTestSuiteRunner
+    from test_app.benchmarks import environment, reads, writes
+
+    runner = CerebrumTestSuiteRunner(verbosity=0)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        if args.suite == 'reads':
+            sizes = [int(size) for size in args.sizes.split(',')]
+            results = reads.run(sizes, repeat=args.repeat or 3, match=args.scenario, skew=args.skew, m2m=args.m2m)
+        else:
+            results = writes.run(args.rows, repeat=args.repeat or 1, match=args.scenario)
+        report = {
+            'suite': args.suite,
+            'environment': environment(),
+            'results': results,
+        }
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
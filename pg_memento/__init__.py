@@ -0,0 +1 @@
+default_app_config = 'pg_memento.apps.PgMemento'
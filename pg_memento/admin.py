@@ -3,17 +3,39 @@ from functools import update_wrapper
 from django.core.checks import messages
 from django.core import urlresolvers
 from django.core.exceptions import PermissionDenied
+from django.db.models import Max, Min
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.shortcuts import render, redirect
-from django.db.models import Q
+from django.utils import formats, timezone
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin, TabularInline
 from django.contrib.admin.templatetags.admin_urls import add_preserved_filters
 from django.contrib.admin import ListFilter
-from django.contrib.contenttypes.models import ContentType
-
-from .models import AuditColumnLog, AuditTableLog, TransactionLog, TableEventLog, RowLog, NonManagedTable, add_audit_id
+from django.contrib.admin.views.main import ChangeList
+
+from .cache import history_cache
+from .pagination import EstimatedCountPaginator, KeysetChangeList
+from .models import (AuditColumnLog, AuditTableLog, TransactionLog, TableEventLog, RowLog, NonManagedTable,
+                     prefetch_history)
+from .registry import registry
+from .revert import revert_row_logs, revert_transaction_range, revert_transactions
+
+
+def message_revert_result(model_admin, request, result):
+    """ Counts per table, and the row logs that could not be reverted """
+    for table, counts in result.counts.items():
+        model_admin.message_user(request, "%s: %s" % (table, ", ".join(
+            "%d %s" % (number, operation) for operation, number in counts.items())))
+    if result.irrevertable:
+        irrev_message = "%d row(s) are irreversible through the admin. IDs are: %s" % (
+            len(result.irrevertable), ", ".join([str(x) for x in result.irrevertable]))
+        model_admin.message_user(request, irrev_message, level=messages.ERROR)
+    if result.skipped:
+        skip_message = "%d row(s) were skipped, their rows no longer exist. IDs are: %s" % (
+            len(result.skipped), ", ".join([str(x) for x in result.skipped]))
+        model_admin.message_user(request, skip_message, level=messages.WARNING)
 
 
 class NoAdditionsMixin(object):
@@ -44,6 +66,10 @@ class AuditColumnLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
 class EventLogInline(TabularInline):
     model = TableEventLog
     extra = 0
+    readonly_fields = ('op_id', 'table_operation', 'table_relid')
+
+    def get_queryset(self, request):
+        return super(EventLogInline, self).get_queryset(request).select_related('table_relid')
 
 
 @admin.register(TransactionLog)
@@ -51,10 +77,40 @@ class TransactionLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
     inlines = [EventLogInline]
     readonly_fields = ('txid', 'stmt_date', 'user_name', 'client_name')
 
+    actions = ['revert_selected_transactions', 'revert_transaction_range_on_server']
+
+    def revert_selected_transactions(self, request, queryset):
+        transaction_ids = list(queryset.values_list('id', flat=True))
+        result = revert_transactions(transaction_ids)
+        if result.reverted:
+            rev_message = "%d row(s) of %d transaction(s) were successfully reverted." % (
+                len(result.reverted), len(transaction_ids))
+            self.message_user(request, rev_message)
+        message_revert_result(self, request, result)
+    revert_selected_transactions.short_description = "Revert selected transaction(s)"
+
+    def revert_transaction_range_on_server(self, request, queryset):
+        """ pgMemento's own revert functions, for everything from the first to the last selected transaction """
+        ids = queryset.aggregate(start=Min('id'), end=Max('id'))
+        result = revert_transaction_range(ids['start'], ids['end'], server=True)
+        if result.backend == 'server':
+            self.message_user(request, "Transactions %d to %d were successfully reverted by pgMemento." % (
+                ids['start'], ids['end']))
+        elif result.reverted:
+            self.message_user(request, "%d row(s) were successfully reverted, pgMemento's revert functions "
+                                       "are not installed." % (len(result.reverted),))
+        message_revert_result(self, request, result)
+    revert_transaction_range_on_server.short_description = (
+        "Revert all transactions from the first to the last selected, in the database")
+
 
 class RowLogInline(TabularInline):
     model = RowLog
     extra = 0
+    readonly_fields = ('audit_id', 'changes')
+
+    def get_queryset(self, request):
+        return super(RowLogInline, self).get_queryset(request).select_related('event__table_relid')
 
 
 @admin.register(TableEventLog)
@@ -98,18 +154,14 @@ class ObjectRowLogFilter(ListFilter):
         object_id = self.used_parameters.get(self.object_id_parameter)
         object_audit_id = self.used_parameters.get(self.object_audit_id_parameter)
         if model_name and (object_id or object_audit_id):
-            try:
-                ct = ContentType.objects.get(model=model_name.lower())
-                model = ct.model_class()
-                add_audit_id(model)
+            model = registry.get_model_by_name(model_name)
+            if model is not None and registry.is_audited(model):
                 try:
                     kwargs = {'pk': object_id} if object_id else {'audit_id': object_audit_id}
                     obj = model.objects.get(**kwargs)
                     return obj
                 except model.DoesNotExist:
                     pass
-            except ContentType.DoesNotExist:
-                pass
 
     @property
     def title(self):
@@ -149,45 +201,12 @@ class ObjectRowLogFilter(ListFilter):
     def expected_parameters(self):
         return self.accepted_params
 
-    def contribute_audit_id(self, model):
-        if not hasattr(model, 'audit_id'):
-            add_audit_id(model)
-
     def get_row_logs(self, queryset, obj):
-        # TODO: not DRY
-        model = type(obj)
-        db_table = model._meta.db_table
-
-        # Self audit
-        self.contribute_audit_id(model)
-        obj.refresh_from_db()
-        row_log_set = queryset.filter(event__table_relid__table_name=db_table,
-                                      audit_id=obj.audit_id)
-
-        # m2m audit
-        if self.used_parameters.get(self.include_m2m_parameter, 'yes') == 'yes':
-            for m2m_field in model._meta.many_to_many:
-                # TODO: `assumed_column_name` this might require refactoring
-                assumed_column_name = m2m_field.remote_field.related_query_name or m2m_field.remote_field.name + '_id'
-                through_model = getattr(model, m2m_field.name).through
-                self.contribute_audit_id(through_model)
-
-                # existing relations
-                audit_ids = through_model.objects.filter(**{assumed_column_name: obj.pk}).values_list('audit_id',
-                                                                                                      flat=True)
-                row_log_set |= RowLog.objects.filter(
-                    Q(audit_id__in=audit_ids) |  # existing relations
-                    Q(**{'changes__' + assumed_column_name: obj.pk}),  # deleted relations
-                    event__table_relid__table_name=through_model._meta.db_table)
-
-                # inserts that are now deleted
-                row_log_set |= RowLog.objects.filter(event__table_relid__table_name=through_model._meta.db_table,
-                                                     audit_id__in=row_log_set.values_list('audit_id', flat=True))
-        row_log_set = row_log_set.select_related('event')  # .order_by('-audit_id')
-        m2m_tables = [x.related_model._meta.db_table for x in model._meta.many_to_many]
-        m2m_tables.append(db_table)
-
-        return row_log_set
+        include_m2m = self.used_parameters.get(self.include_m2m_parameter, 'yes') == 'yes'
+        ids = history_cache.get_ids(obj, include_m2m=include_m2m)
+        if ids is not None:
+            return queryset.filter(pk__in=ids).select_related('event__table_relid')
+        return queryset.history_of(obj, include_m2m=include_m2m).select_related('event__table_relid')
 
 
 @admin.register(RowLog)
@@ -195,6 +214,7 @@ class RowLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
 
     list_display = ('pk', 'get_table_operation', 'get_table_name', 'changes', 'get_audit_id_url', 'get_select')
     list_filter = (ObjectRowLogFilter, 'event__table_operation', 'event__table_relid__table_name', )
+    list_select_related = ('event__table_relid', )
 
     # Additional fields
 
@@ -233,19 +253,11 @@ class RowLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
     actions = ['undo_changes']
 
     def undo_changes(self, request, queryset):
-        irrevertable = []
-        for row_log in queryset.order_by('-id'):
-            try:
-                row_log.revert()
-            except NonManagedTable:
-                irrevertable.append(row_log)
-        if len(queryset) > len(irrevertable):
-            rev_message = "%d row(s) were successfully reverted." % (len(queryset) - len(irrevertable),)
+        result = revert_row_logs(queryset)
+        if result.reverted:
+            rev_message = "%d row(s) were successfully reverted." % (len(result.reverted),)
             self.message_user(request, rev_message)
-        if irrevertable:
-            irrev_message = "%d row(s) are irreversible through the admin. IDs are: %s" % (
-                len(irrevertable), ", ".join([str(x.pk) for x in irrevertable]))
-            self.message_user(request, irrev_message, level=messages.ERROR)
+        message_revert_result(self, request, result)
     undo_changes.short_description = "Revert selected changes"
 
     # Other
@@ -294,9 +306,8 @@ class RowLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
     change_list_template = 'change_list.html'
 
     def get_changelist(self, request, **kwargs):
-        from django.contrib.admin.views.main import ChangeList
 
-        class ObjectChangeList(ChangeList):
+        class ObjectChangeList(KeysetChangeList):
 
             def get_queryset(self, request):
                 # filter down to object-related RowLogs
@@ -304,6 +315,9 @@ class RowLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
 
         return ObjectChangeList
 
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+
     def changelist_view(self, request, extra_context=None):
         extra = {}
         response = super(RowLogAdmin, self).changelist_view(request, extra_context=extra)
@@ -330,14 +344,40 @@ class RowLogAdmin(NoAdditionsMixin, admin.ModelAdmin):
             return dict(obj=obj, obj_model=model.__name__, obj_url=obj_url)
 
 
+class HistoryChangeList(ChangeList):
+    """ Attaches the newest RowLog of every object on the page, in one query, for `last_change` """
+
+    def get_results(self, request):
+        super(HistoryChangeList, self).get_results(request)
+        if 'last_change' in self.list_display and registry.is_audited(self.model):
+            prefetch_history(self.result_list, limit=1)
+
+
 class VersionModelAdmin(ModelAdmin):
     change_form_template = 'change_form.html'
     manage_view_template = 'manage_view.html'
+    manage_view_history_template = 'manage_view_history.html'
 
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = super(VersionModelAdmin, self).get_readonly_fields(request, obj)
-        self.contribute_audit_id(self.model)
-        return readonly_fields + ('audit_id', )
+        if registry.is_audited(self.model):
+            readonly_fields = tuple(readonly_fields) + ('audit_id', )
+        return readonly_fields
+
+    def get_changelist(self, request, **kwargs):
+        return HistoryChangeList
+
+    # Additional fields
+
+    def last_change(self, obj):
+        """ list_display column: when and by whom the object was last changed """
+        history = getattr(obj, 'history', None)
+        if not history:
+            return '-'
+        transaction = history[0].event.transaction
+        return '%s, %s (%s)' % (formats.localize(timezone.template_localtime(transaction.stmt_date)),
+                                transaction.user_name, history[0].event.table_operation)
+    last_change.short_description = 'Last change'
 
     def get_urls(self):
         from django.conf.urls import patterns, url
@@ -374,7 +414,6 @@ class VersionModelAdmin(ModelAdmin):
 
     def manage_view(self, request, id, form_url='', extra_context=None):
         opts = self.model._meta
-        self.contribute_audit_id(self.model)
         obj = self.model.objects.get(pk=id)
 
         if not self.has_change_permission(request, obj):
@@ -383,8 +422,9 @@ class VersionModelAdmin(ModelAdmin):
         preserved_filters = self.get_preserved_filters(request)
         form_url = add_preserved_filters({'preserved_filters': preserved_filters, 'opts': opts}, form_url)
 
-        # Get changes
+        # Get changes, rendered from the history cache while they are current
         history = self.get_row_logs(obj=obj)
+        history_table = history_cache.render(obj, self.manage_view_history_template, history, request=request)
 
         context = {
             'title': 'Manage %s' % obj,
@@ -392,6 +432,7 @@ class VersionModelAdmin(ModelAdmin):
             'form_url': form_url,
             'opts': opts,
             'history': history,
+            'history_table': mark_safe(history_table),
             'app_label': opts.app_label,
             'original': obj,
         }
@@ -399,35 +440,5 @@ class VersionModelAdmin(ModelAdmin):
 
         return render(request, self.manage_view_template, context)
 
-    def contribute_audit_id(self, model):
-        if not hasattr(model, 'audit_id'):
-            add_audit_id(model)
-
     def get_row_logs(self, obj):
-        db_table = self.model._meta.db_table
-        print(db_table)
-
-        # Self audit
-        row_log_set = RowLog.objects.filter(event__table_relid__table_name=db_table,
-                                            audit_id=obj.audit_id)
-
-        # m2m audit
-        for m2m_field in self.model._meta.many_to_many:
-            assumed_column_name = m2m_field.remote_field.related_query_name + '_id'
-            through_model = getattr(self.model, m2m_field.name).through
-            self.contribute_audit_id(through_model)
-
-            # existing relations
-            audit_ids = through_model.objects.filter(**{assumed_column_name: obj.pk}).values_list('audit_id', flat=True)
-            row_log_set |= RowLog.objects.filter(Q(audit_id__in=audit_ids) |  # existing relations
-                                                 Q(**{'changes__' + assumed_column_name: obj.pk}),  # deleted relations
-                                                 event__table_relid__table_name=through_model._meta.db_table)
-
-            # inserts that are now deleted
-            row_log_set |= RowLog.objects.filter(event__table_relid__table_name=through_model._meta.db_table,
-                                                 audit_id__in=row_log_set.values_list('audit_id', flat=True))
-        row_log_set = row_log_set.select_related('event').order_by('-audit_id')
-        m2m_tables = [x.related_model._meta.db_table for x in self.model._meta.many_to_many]
-        m2m_tables.append(db_table)
-
-        return row_log_set
+        return RowLog.objects.history_of(obj).select_related('event__table_relid').order_by('-audit_id')
@@ -0,0 +1,71 @@
+"""
+asyncio flavour of `feed.ChangeFeed`, Python 3.5+ only.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .feed import ChangeFeed, CONNECTION_ERRORS
+
+
+class AsyncChangeFeed(ChangeFeed):
+    """
+    `ChangeFeed` as an async iterator::
+
+        async for batch in AsyncChangeFeed(CacheCheckpoint('search_index')):
+            await reindex(batch)
+
+    The listening connection is watched by the event loop, the ORM queries
+    run on a single worker thread of the feed's own, so they keep one
+    database connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._notified = set()
+        self._consumed = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        loop = asyncio.get_event_loop()
+        if self._consumed:
+            await self.run(loop, self.commit, self._consumed)
+            self._consumed = None
+        while True:
+            try:
+                if self.listener is None:
+                    await self.run(loop, self.start)
+                batch = await self.run(loop, self.next_batch, self._notified)
+                self._notified = set()
+                if batch:
+                    self._consumed = batch
+                    return batch
+                self._notified = await self.wait_async(loop)
+            except CONNECTION_ERRORS:
+                await self.run(loop, self.reconnect)
+                await asyncio.sleep(self.reconnect_delay)
+
+    def run(self, loop, func, *args):
+        return loop.run_in_executor(self._executor, func, *args)
+
+    async def wait_async(self, loop):
+        if not self.listener:
+            await asyncio.sleep(self.timeout)
+            return set()
+        readable = loop.create_future()
+        fileno = self.listener.fileno()
+        loop.add_reader(fileno, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, self.timeout)
+        except asyncio.TimeoutError:
+            return set()
+        finally:
+            loop.remove_reader(fileno)
+        return self.drain()
+
+    async def aclose(self):
+        """ Close the connections of the feed """
+        await self.run(asyncio.get_event_loop(), self.close)
+        self._executor.shutdown(wait=False)
@@ -1,7 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 from django.db.models.signals import post_migrate
 
 
 class PgMemento(AppConfig):
     name = 'pg_memento'
     verbose_name = "pgMemento"
+
+    def ready(self):
+        from .registry import registry
+        from .schema import schema_history
+
+        registry.populate()
+        post_migrate.connect(registry.invalidate, dispatch_uid='pg_memento_registry_invalidate')
+        post_migrate.connect(schema_history.invalidate, dispatch_uid='pg_memento_schema_history_invalidate')
+        connection_created.connect(registry.connection_created, dispatch_uid='pg_memento_attach_audit_ids')
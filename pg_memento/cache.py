@@ -0,0 +1,127 @@
+from django.core.cache import caches
+from django.db import connections, router
+from django.template.loader import render_to_string
+
+from .conf import get_history_cache, get_history_cache_timeout, get_history_cache_max_rows
+from .models import AuditTableLog, RowLog, TableEventLog
+from .routers import latest_row_log_id, use_primary
+
+KEY_PREFIX = 'pg_memento:history'
+
+
+# the newest RowLog of the object's own rows and the newest event of each of its m2m tables, each
+# one lookup on the (audit_id, id) and (table_relid, id) indexes that `ensurelogindexes` creates
+PROBE_OWN_ROWS = "(SELECT max(id) FROM {row_log} WHERE audit_id = %s)"
+
+PROBE_TABLE = """
+(SELECT max(newest) FROM (
+    SELECT (SELECT max(e.id) FROM {table_event_log} e WHERE e.table_relid = a.relid) AS newest
+    FROM {audit_table_log} a WHERE a.table_name = %s AND upper_inf(a.txid_range)
+) relids)
+"""
+
+
+class HistoryCache(object):
+    """
+    Object histories on Django's cache framework, keyed by (table, audit_id, version).
+
+    Whether a cached history is still current is probed on the primary, so
+    a lagging replica can't validate a stale entry: the newest RowLog id
+    overall is one index lookup, and while it hasn't moved the history
+    can't have either. Any write to a logged table moves it though, so on a
+    busy database the probe mostly goes on to the version of the object's
+    history: the newest RowLog with its `audit_id` and, for its many-to-many
+    relations, the newest event on each through table. These are index
+    lookups too, never the history query itself. Audit ids are unique
+    across tables, and should one match another table's row after all, the
+    history is only read again sooner than needed.
+
+    Histories longer than PG_MEMENTO_HISTORY_CACHE_MAX_ROWS are not cached,
+    entries expire after PG_MEMENTO_HISTORY_CACHE_TIMEOUT seconds. A change
+    committed after a newer one is only seen once its entry expires.
+    """
+
+    @property
+    def cache(self):
+        alias = get_history_cache()
+        return caches[alias] if alias else None
+
+    def key(self, obj, include_m2m, *parts):
+        parts = (KEY_PREFIX, obj._meta.db_table, obj.audit_id, int(include_m2m)) + parts
+        return ':'.join(str(part) for part in parts)
+
+    def probe_sql(self, obj, include_m2m, connection):
+        """ The statement reading the version of the object's history, with its params """
+        qn = connection.ops.quote_name
+        tables = dict(row_log=qn(RowLog._meta.db_table),
+                      table_event_log=qn(TableEventLog._meta.db_table),
+                      audit_table_log=qn(AuditTableLog._meta.db_table))
+        parts = [PROBE_OWN_ROWS.format(**tables)]
+        params = [obj.audit_id]
+        if include_m2m:
+            for m2m_field in obj._meta.many_to_many:
+                parts.append(PROBE_TABLE.format(**tables))
+                params.append(m2m_field.remote_field.through._meta.db_table)
+        return 'SELECT %s' % ', '.join(parts), params
+
+    def probe(self, obj, include_m2m=True):
+        """ Version of the object's history, which changes whenever the history does """
+        cache = self.cache
+        latest = latest_row_log_id()
+        key = self.key(obj, include_m2m)
+        checked = cache.get(key) if cache else None
+        if checked is not None and checked[1] == latest:
+            return checked[0]
+        with use_primary():
+            connection = connections[router.db_for_read(RowLog)]
+            with connection.cursor() as cursor:
+                cursor.execute(*self.probe_sql(obj, include_m2m, connection))
+                version = '.'.join(str(newest) for newest in cursor.fetchone())
+        if cache:
+            cache.set(key, (version, latest), get_history_cache_timeout())
+        return version
+
+    def get_or_set(self, obj, include_m2m, version, kind, compute, size=len):
+        cache = self.cache
+        if cache is None:
+            return compute()
+        key = self.key(obj, include_m2m, version, kind)
+        value = cache.get(key)
+        if value is None:
+            # stored under a version read from the primary, a replica could still miss the newest rows
+            with use_primary():
+                value = compute()
+            if size(value) <= get_history_cache_max_rows():
+                cache.set(key, value, get_history_cache_timeout())
+        return value
+
+    def get(self, obj, queryset, include_m2m=True, version=None):
+        """ `queryset`, the object's history, as a list """
+        if version is None and self.cache:
+            version = self.probe(obj, include_m2m)
+        return self.get_or_set(obj, include_m2m, version, 'rows', lambda: list(queryset))
+
+    def get_ids(self, obj, include_m2m=True):
+        """ Ids of the object's RowLogs, None if there are too many of them to cache """
+        if not self.cache:
+            return None
+        limit = get_history_cache_max_rows()
+
+        def ids():
+            return list(RowLog.objects.history_of(obj, include_m2m).values_list('id', flat=True)[:limit + 1])
+
+        ids = self.get_or_set(obj, include_m2m, self.probe(obj, include_m2m), 'ids', ids)
+        return ids if len(ids) <= limit else None
+
+    def render(self, obj, template_name, queryset, include_m2m=True, request=None):
+        """
+        `template_name` rendered with the object's `history`, from `queryset`.
+
+        Only the rows are cached: the template is rendered for every request,
+        with its own user, permissions and CSRF token.
+        """
+        history = self.get(obj, queryset, include_m2m)
+        return render_to_string(template_name, {'history': history, 'original': obj}, request=request)
+
+
+history_cache = HistoryCache()
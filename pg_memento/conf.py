@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+IGNORE_TABLES = ['reversion_revision',  # Don't see the need to log reversions in case it's installed
+                 'reversion_version']
+
+
+def get_ignore_tables():
+    return getattr(settings, 'PG_MEMENTO_IGNORE_TABLES', IGNORE_TABLES)
+
+
+def get_lock_timeout():
+    return getattr(settings, 'PG_MEMENTO_LOCK_TIMEOUT', '2s')
+
+
+def get_databases():
+    """ Aliases of the databases pgMemento is installed on """
+    return list(getattr(settings, 'PG_MEMENTO_DATABASES', [DEFAULT_DB_ALIAS]))
+
+
+def get_schemas(using=DEFAULT_DB_ALIAS):
+    """ Schemas logged on database `using`, PG_MEMENTO_SCHEMAS is a list or a dict keyed by alias """
+    schemas = getattr(settings, 'PG_MEMENTO_SCHEMAS', ['public'])
+    if isinstance(schemas, dict):
+        schemas = schemas.get(using, ['public'])
+    return list(schemas)
+
+
+def get_read_database():
+    """ Alias the audit log is read from, see routers.PgMementoRouter """
+    return getattr(settings, 'PG_MEMENTO_READ_DATABASE', None)
+
+
+def get_max_replica_lag():
+    """ Seconds the read database may lag behind before reads go back to the primary, None to never check """
+    return getattr(settings, 'PG_MEMENTO_READ_MAX_LAG', None)
+
+
+def get_model_options():
+    """ PG_MEMENTO_MODELS: 'app_label.model_name' -> {'log': bool, 'exclude_columns': [...]} """
+    return dict((name.lower(), options) for name, options in getattr(settings, 'PG_MEMENTO_MODELS', {}).items())
+
+
+def is_opt_in():
+    """ With PG_MEMENTO_OPT_IN only models with 'log': True are logged """
+    return getattr(settings, 'PG_MEMENTO_OPT_IN', False)
+
+
+def get_notify_channel():
+    """ PG_MEMENTO_NOTIFY: True, or a channel name, to NOTIFY every logged transaction at commit """
+    channel = getattr(settings, 'PG_MEMENTO_NOTIFY', False)
+    if channel is True:
+        return 'pg_memento'
+    return channel or None
+
+
+def get_history_cache():
+    """ Cache alias object histories are kept in, None to not cache them """
+    return getattr(settings, 'PG_MEMENTO_HISTORY_CACHE', 'default')
+
+
+def get_history_cache_timeout():
+    return getattr(settings, 'PG_MEMENTO_HISTORY_CACHE_TIMEOUT', 300)
+
+
+def get_history_cache_max_rows():
+    """ Longer histories are not cached """
+    return getattr(settings, 'PG_MEMENTO_HISTORY_CACHE_MAX_ROWS', 1000)
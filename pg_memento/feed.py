@@ -0,0 +1,177 @@
+import json
+import select
+import time
+from collections import deque
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import connections, DEFAULT_DB_ALIAS, InterfaceError, OperationalError
+from psycopg2 import InterfaceError as DriverInterfaceError, OperationalError as DriverOperationalError
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from .conf import get_notify_channel
+from .models import RowLog
+from .routers import use_primary
+
+# errors after which the feed reconnects and picks up from its checkpoint
+CONNECTION_ERRORS = (InterfaceError, OperationalError, DriverInterfaceError, DriverOperationalError)
+
+# how many transaction ids of yielded rows are remembered, to skip their late notifications
+SEEN_TRANSACTIONS = 10000
+
+
+class MemoryCheckpoint(object):
+    """ Keeps the position of a feed for the lifetime of the process """
+
+    def __init__(self, row_log_id=None):
+        self.row_log_id = row_log_id
+
+    def load(self):
+        return self.row_log_id
+
+    def save(self, row_log_id):
+        self.row_log_id = row_log_id
+
+
+class CacheCheckpoint(object):
+    """ Keeps the position of a feed in a Django cache, so a restarted consumer resumes from it """
+
+    def __init__(self, key='pg_memento_feed', cache=DEFAULT_CACHE_ALIAS):
+        self.key = key
+        self.cache = caches[cache]
+
+    def load(self):
+        return self.cache.get(self.key)
+
+    def save(self, row_log_id):
+        self.cache.set(self.key, row_log_id, None)
+
+
+class ChangeFeed(object):
+    """
+    Batches of new RowLogs, in id order, as their transactions commit.
+
+    Iterating blocks until there is something new: a NOTIFY from the
+    `initlogging` trigger (PG_MEMENTO_NOTIFY) or, without it, every
+    `timeout` seconds. A batch counts as consumed when the next one is
+    asked for, only then the checkpoint moves past it; a new feed starts
+    from the checkpoint, or from the newest RowLog when it is empty::
+
+        for batch in ChangeFeed(CacheCheckpoint('search_index'), tables=['shop_product']):
+            reindex(batch)
+
+    Lost connections are reopened after `reconnect_delay` seconds.
+    Rows of a transaction that commits after a newer one got its rows
+    yielded are picked up by the notification of that transaction.
+    """
+
+    def __init__(self, checkpoint=None, tables=None, batch_size=500, timeout=30.0, using=DEFAULT_DB_ALIAS,
+                 channel=None, reconnect_delay=1.0):
+        self.checkpoint = checkpoint or MemoryCheckpoint()
+        self.tables = set(tables or [])
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.using = using
+        self.channel = channel or get_notify_channel()
+        self.reconnect_delay = reconnect_delay
+        self.listener = None
+        self.last = None
+        self._seen = deque()
+        self._seen_ids = set()
+
+    def __iter__(self):
+        notified = set()
+        try:
+            while True:
+                try:
+                    if self.listener is None:
+                        self.start()
+                    batch = self.next_batch(notified)
+                    notified = set()
+                    if batch:
+                        yield batch
+                        self.commit(batch)
+                    else:
+                        notified = self.wait()
+                except CONNECTION_ERRORS:
+                    self.reconnect()
+                    time.sleep(self.reconnect_delay)
+        finally:
+            self.close()
+
+    def start(self):
+        """ Listen first, then read the checkpoint, so nothing committed in between is missed """
+        if self.channel:
+            self.listen()
+        else:
+            self.listener = False
+        self.last = self.checkpoint.load()
+        if self.last is None:
+            with use_primary():
+                self.last = RowLog.objects.using(self.using).order_by('-id').values_list('id', flat=True).first()
+            self.last = self.last or 0
+            self.checkpoint.save(self.last)
+
+    def listen(self):
+        connection = connections[self.using]
+        self.listener = connection.get_new_connection(connection.get_connection_params())
+        self.listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.listener.cursor() as cursor:
+            cursor.execute('LISTEN %s' % connection.ops.quote_name(self.channel))
+
+    def close(self):
+        if self.listener:
+            try:
+                self.listener.close()
+            except CONNECTION_ERRORS:
+                pass
+        self.listener = None
+
+    def reconnect(self):
+        """ Start over from the checkpoint with new connections """
+        self.close()
+        connections[self.using].close_if_unusable_or_obsolete()
+
+    def wait(self):
+        """ Ids of the transactions notified within `timeout` seconds """
+        if not self.listener:
+            time.sleep(self.timeout)
+            return set()
+        if select.select([self.listener], [], [], self.timeout) == ([], [], []):
+            return set()
+        return self.drain()
+
+    def drain(self):
+        self.listener.poll()
+        transaction_ids = set()
+        while self.listener.notifies:
+            notify = self.listener.notifies.pop(0)
+            payload = json.loads(notify.payload)
+            if not self.tables or self.tables.intersection(payload['tables']):
+                transaction_ids.add(payload['transaction_id'])
+        return transaction_ids
+
+    def get_queryset(self):
+        queryset = RowLog.objects.using(self.using).select_related('event__table_relid')
+        if self.tables:
+            queryset = queryset.filter(event__table_relid__table_name__in=self.tables)
+        return queryset.order_by('id')
+
+    def next_batch(self, notified):
+        """ Rows of notified transactions that were passed over, else the next rows after the checkpoint """
+        with use_primary():
+            late = notified - self._seen_ids
+            if late:
+                batch = list(self.get_queryset().filter(id__lte=self.last, event__transaction_id__in=late))
+                if batch:
+                    return batch
+            return list(self.get_queryset().filter(id__gt=self.last)[:self.batch_size])
+
+    def commit(self, batch):
+        self.last = max(self.last, batch[-1].id)
+        for transaction_id in set(row_log.event.transaction_id for row_log in batch):
+            if transaction_id not in self._seen_ids:
+                self._seen.append(transaction_id)
+                self._seen_ids.add(transaction_id)
+        while len(self._seen) > SEEN_TRANSACTIONS:
+            self._seen_ids.discard(self._seen.popleft())
+        self.checkpoint.save(self.last)
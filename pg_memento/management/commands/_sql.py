@@ -1,4 +1,9 @@
-from django.db import connection
+import re
+import time
+
+from django.db import connections, transaction, OperationalError, DEFAULT_DB_ALIAS
+
+from ...suspend import SUSPEND_ALL, SUSPEND_SETTING
 
 
 INIT_PG_MOMENTO = """
@@ -6,32 +11,205 @@ INIT_PG_MOMENTO = """
 SELECT pgmemento.create_schema_event_trigger(0);
 
 -- 'Creating triggers for tables in ':schema_name' schema ...'
-SELECT pgmemento.create_schema_log_trigger('public', string_to_array('%s',','));
+SELECT pgmemento.create_schema_log_trigger(%(schema)s, string_to_array(%(ignore)s,','));
 
 -- 'Creating audit_id columns for tables in ':schema_name' schema ...'
-SELECT pgmemento.create_schema_audit_id('public', string_to_array('%s',','));
+SELECT pgmemento.create_schema_audit_id(%(schema)s, string_to_array(%(ignore)s,','));
 """
 
 
 DROP_SCHEMA_LOG_IGNORE = """
-SELECT pgmemento.drop_schema_log_trigger('public', string_to_array('%s',','));
+SELECT pgmemento.drop_schema_log_trigger(%(schema)s, string_to_array(%(ignore)s,','));
 """
 
 DROP_SCHEMA_LOG = """
-SELECT pgmemento.drop_schema_log_trigger('public');
+SELECT pgmemento.drop_schema_log_trigger(%(schema)s);
 """
 
+INIT_EVENT_TRIGGER = "SELECT pgmemento.create_schema_event_trigger(0)"
+
+CREATE_TABLE_LOG = [
+    "SELECT pgmemento.create_table_log_trigger(%s, %s)",
+    "SELECT pgmemento.create_table_audit_id(%s, %s)",
+]
+
+DROP_TABLE_LOG = [
+    "SELECT pgmemento.drop_table_log_trigger(%s, %s)",
+]
 
-def init(ignore_tables):
-    cursor = connection.cursor()
+LOGGED_TABLES = """
+SELECT tablename FROM pgmemento.audit_tables WHERE schemaname = %s AND tg_is_active
+"""
+
+EXISTING_TABLES = """
+SELECT tablename FROM pg_tables WHERE schemaname = %s
+"""
 
-    cursor.execute(INIT_PG_MOMENTO % (','.join(ignore_tables), ','.join(ignore_tables)))
+UPDATE_TRIGGER = 'log_update_trigger'
 
+LOG_TRIGGERS = ('log_insert_trigger', UPDATE_TRIGGER, 'log_delete_trigger', 'log_truncate_trigger')
 
-def uninit(ignore_tables=None):
-    cursor = connection.cursor()
+# the trigger, its definition and the condition it was last given by `set_trigger_condition`
+TRIGGER_DEFINITION = """
+SELECT pg_get_triggerdef(t.oid), obj_description(t.oid, 'pg_trigger')
+FROM pg_trigger t
+WHERE t.tgrelid = to_regclass(format('%%I.%%I', %s, %s)) AND t.tgname = %s
+"""
+
+TRIGGER_PARTS = re.compile(r'^(?P<head>.*? FOR EACH (?:ROW|STATEMENT))(?: WHEN \(.*\))?'
+                           r' (?P<execute>EXECUTE (?:PROCEDURE|FUNCTION) .*)$', re.DOTALL)
+
+# fires at commit for every event of a transaction; NOTIFY drops the identical payloads, so one is sent
+CREATE_NOTIFY = """
+CREATE OR REPLACE FUNCTION pgmemento.notify_transaction() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(TG_ARGV[0], (
+    SELECT json_build_object('transaction_id', NEW.transaction_id,
+                             'tables', json_agg(DISTINCT a.table_name ORDER BY a.table_name))::text
+    FROM pgmemento.table_event_log e
+    JOIN pgmemento.audit_table_log a ON a.relid = e.table_relid
+    WHERE e.transaction_id = NEW.transaction_id));
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_transaction_trigger ON pgmemento.table_event_log;
+
+CREATE CONSTRAINT TRIGGER notify_transaction_trigger AFTER INSERT ON pgmemento.table_event_log
+DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE pgmemento.notify_transaction({channel});
+"""
+
+DROP_NOTIFY = """
+DROP TRIGGER IF EXISTS notify_transaction_trigger ON pgmemento.table_event_log;
+DROP FUNCTION IF EXISTS pgmemento.notify_transaction();
+"""
+
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def init(ignore_tables, schema='public', using=DEFAULT_DB_ALIAS):
+    cursor = connections[using].cursor()
+
+    cursor.execute(INIT_PG_MOMENTO, {'schema': schema, 'ignore': ','.join(ignore_tables)})
+
+
+def uninit(ignore_tables=None, schema='public', using=DEFAULT_DB_ALIAS):
+    cursor = connections[using].cursor()
 
     if ignore_tables is None:
-        cursor.execute(DROP_SCHEMA_LOG)
+        cursor.execute(DROP_SCHEMA_LOG, {'schema': schema})
     else:
-        cursor.execute(DROP_SCHEMA_LOG_IGNORE % (','.join(ignore_tables),))
+        cursor.execute(DROP_SCHEMA_LOG_IGNORE, {'schema': schema, 'ignore': ','.join(ignore_tables)})
+
+
+def init_notify(channel, using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(CREATE_NOTIFY.format(channel=quote_literal(channel)))
+
+
+def uninit_notify(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(DROP_NOTIFY)
+
+
+def init_event_trigger(using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(INIT_EVENT_TRIGGER)
+
+
+def logged_tables(schema='public', using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(LOGGED_TABLES, [schema])
+        return set(row[0] for row in cursor.fetchall())
+
+
+def existing_tables(schema='public', using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(EXISTING_TABLES, [schema])
+        return set(row[0] for row in cursor.fetchall())
+
+
+def run_locked(statements, lock_timeout, retries, using=DEFAULT_DB_ALIAS, delay=1.0):
+    """
+    Run `statements` in a transaction of their own that gives up waiting for
+    locks after `lock_timeout`, retrying up to `retries` times with a growing delay.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic(using=using):
+                with connections[using].cursor() as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", [lock_timeout])
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
+            return
+        except OperationalError as e:
+            if getattr(e.__cause__, 'pgcode', None) != LOCK_NOT_AVAILABLE or attempt == retries:
+                raise
+            time.sleep(delay * (attempt + 1))
+
+
+def init_table(table, lock_timeout, retries, schema='public', using=DEFAULT_DB_ALIAS):
+    run_locked([(sql, [table, schema]) for sql in CREATE_TABLE_LOG], lock_timeout, retries, using=using)
+
+
+def uninit_table(table, lock_timeout, retries, schema='public', using=DEFAULT_DB_ALIAS):
+    run_locked([(sql, [table, schema]) for sql in DROP_TABLE_LOG], lock_timeout, retries, using=using)
+
+
+def quote_literal(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def update_condition(exclude_columns):
+    """ WHEN condition of the update trigger that skips updates of only `exclude_columns` """
+    if not exclude_columns:
+        return None
+    removed = ''.join(' - %s' % quote_literal(column) for column in exclude_columns)
+    return '(to_jsonb(OLD)%s) IS DISTINCT FROM (to_jsonb(NEW)%s)' % (removed, removed)
+
+
+def suspend_condition(table, schema='public'):
+    """ WHEN condition that skips the table while it is suspended by `suspend_logging` in the session """
+    names = ', '.join(quote_literal(name) for name in (SUSPEND_ALL, table, '%s.%s' % (schema, table)))
+    return "NOT coalesce(string_to_array(current_setting(%s, true), ',') && ARRAY[%s], false)" % (
+        quote_literal(SUSPEND_SETTING), names)
+
+
+def trigger_condition(trigger, table, exclude_columns=(), schema='public'):
+    """ WHEN condition of one of the LOG_TRIGGERS """
+    conditions = [suspend_condition(table, schema)]
+    if trigger == UPDATE_TRIGGER and exclude_columns:
+        conditions.append(update_condition(exclude_columns))
+    return ' AND '.join('(%s)' % condition for condition in conditions)
+
+
+def with_condition(definition, condition):
+    """ Trigger definition, as given by pg_get_triggerdef, with its WHEN clause replaced """
+    match = TRIGGER_PARTS.match(definition)
+    if match is None:
+        raise ValueError('Unexpected trigger definition: %s' % definition)
+    when = ' WHEN (%s)' % condition if condition else ''
+    return '%s%s %s' % (match.group('head'), when, match.group('execute'))
+
+
+def set_trigger_condition(table, trigger, condition, lock_timeout, retries, schema='public',
+                          using=DEFAULT_DB_ALIAS):
+    """
+    Recreate `trigger` with the WHEN `condition` (None for none). The condition is
+    kept as the trigger's comment, so unchanged triggers are left alone.
+    Returns whether the trigger was changed.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(TRIGGER_DEFINITION, [schema, table, trigger])
+        row = cursor.fetchone()
+    if row is None or (row[1] or None) == condition:
+        return False
+    qn = connections[using].ops.quote_name
+    on = '%s ON %s.%s' % (qn(trigger), qn(schema), qn(table))
+    statements = [
+        ('DROP TRIGGER %s' % on, None),
+        (with_condition(row[0], condition), None),
+        ('COMMENT ON TRIGGER %s IS %s' % (on, quote_literal(condition) if condition else 'NULL'), None),
+    ]
+    run_locked(statements, lock_timeout, retries, using=using)
+    return True
@@ -0,0 +1,162 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from ...cache import history_cache
+from ...models import RowLog
+from ...registry import registry
+
+SCHEMA = 'pgmemento'
+
+# (name, table, access method, key) for every lookup path of the package's own queries
+LOG_INDEXES = (
+    ('row_log_audit_id_idx', 'row_log', 'btree', 'audit_id, id'),
+    ('row_log_event_id_idx', 'row_log', 'btree', 'event_id'),
+    ('row_log_changes_idx', 'row_log', 'gin', 'changes jsonb_path_ops'),
+    ('table_event_log_table_relid_idx', 'table_event_log', 'btree', 'table_relid, id'),
+    ('table_event_log_transaction_id_idx', 'table_event_log', 'btree', 'transaction_id'),
+    ('audit_table_log_table_name_idx', 'audit_table_log', 'btree', 'table_name'),
+)
+
+# invalid indexes are left behind by a failed or cancelled CREATE INDEX CONCURRENTLY
+EXISTING_INDEXES = """
+SELECT c.relname, am.amname, pg_get_indexdef(i.indexrelid), i.indisvalid
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_am am ON am.oid = c.relam
+WHERE i.indrelid = to_regclass(%s)
+"""
+
+IS_PARTITIONED = """
+SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))
+"""
+
+PARTITIONS = """
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass(%s)
+ORDER BY c.relname
+"""
+
+INDEX_KEYS = re.compile(r'USING \w+ \((.*?)\)(?: INCLUDE .*)?$')
+
+
+class Command(BaseCommand):
+    help = 'Create the indexes used by the pgMemento history lookups, if they are missing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+                            help='only print the missing indexes and the current plans')
+        parser.add_argument('--database', dest='database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.connection = connections[options['database']]
+        self.dry_run = options['dry_run']
+        if self.connection.in_atomic_block:
+            raise CommandError('CREATE INDEX CONCURRENTLY can not run inside a transaction')
+
+        self.explain_all('before')
+        missing = [index for index in LOG_INDEXES if not self.has_index(*index[1:])]
+        for name, table, method, key in missing:
+            self.create_index(name, table, method, key)
+        if not missing:
+            self.stdout.write('All indexes are in place.')
+        elif not options['dry_run']:
+            self.explain_all('after')
+        self.stdout.write(self.style.SUCCESS('Done!'))
+
+    def fetch(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def execute(self, sql):
+        self.stdout.write(sql)
+        if not self.dry_run:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql)
+
+    @staticmethod
+    def key_items(key):
+        """ The columns of an index key, each with its operator class and ordering, if any """
+        return [' '.join(item.replace('"', '').split()).lower() for item in key.split(',')]
+
+    @classmethod
+    def serves(cls, amname, definition, method, key):
+        """
+        Any full index of the same method whose key starts with the same
+        columns, in the same operator classes, will serve the lookup
+        """
+        match = INDEX_KEYS.search(definition)
+        if amname != method or not match or ' WHERE ' in definition:
+            return False
+        wanted = cls.key_items(key)
+        return cls.key_items(match.group(1))[:len(wanted)] == wanted
+
+    def matching_indexes(self, qualified, method, key):
+        """ Names and validity of the indexes of `qualified` that serve the lookup """
+        return [(name, valid) for name, amname, definition, valid in self.fetch(EXISTING_INDEXES, [qualified])
+                if self.serves(amname, definition, method, key)]
+
+    def has_index(self, table, method, key):
+        return any(valid for name, valid in self.matching_indexes('%s.%s' % (SCHEMA, table), method, key))
+
+    def drop_invalid(self, qualified, method, key, keep=None, concurrently=True):
+        for name, valid in self.matching_indexes(qualified, method, key):
+            if not valid and name != keep:
+                self.execute('DROP INDEX%s IF EXISTS %s.%s' % (' CONCURRENTLY' if concurrently else '', SCHEMA, name))
+
+    def create_index(self, name, table, method, key):
+        qualified = '%s.%s' % (SCHEMA, table)
+        if not self.fetch(IS_PARTITIONED, [qualified])[0][0]:
+            self.drop_invalid(qualified, method, key)
+            self.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s USING %s (%s)' % (
+                name, qualified, method, key))
+            return
+
+        # partitioned tables don't support CONCURRENTLY: the parent gets an index of its own only,
+        # which turns valid once every partition has been indexed concurrently and attached
+        self.drop_invalid(qualified, method, key, keep=name, concurrently=False)
+        self.execute('CREATE INDEX IF NOT EXISTS %s ON ONLY %s USING %s (%s)' % (name, qualified, method, key))
+        for partition in self.fetch(PARTITIONS, [qualified]):
+            partition = partition[0]
+            partition_qualified = '%s.%s' % (SCHEMA, partition)
+            self.drop_invalid(partition_qualified, method, key)
+            valid = [index for index, is_valid in self.matching_indexes(partition_qualified, method, key) if is_valid]
+            if valid:
+                partition_index = valid[0]
+            else:
+                partition_index = partition + name[len(table):]
+                self.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s USING %s (%s)' % (
+                    partition_index, partition_qualified, method, key))
+            self.execute('ALTER INDEX %s.%s ATTACH PARTITION %s.%s' % (SCHEMA, name, SCHEMA, partition_index))
+
+    def get_queries(self):
+        """
+        (name, sql, params) of the lookups the indexes are for, as done for
+        the most recently changed object: its history in the admin views,
+        the version the history cache is probed with, and the deltas its
+        state as of an earlier transaction is rebuilt from
+        """
+        row_logs = RowLog.objects.using(self.connection.alias)
+        latest = row_logs.select_related('event__table_relid', 'event__transaction').order_by('-id').first()
+        if latest is None:
+            return []
+        model = registry.get_model_for_table(latest.event.table_relid.table_name)
+        if model is None or not registry.is_audited(model):
+            return []
+        obj = model._default_manager.using(self.connection.alias).filter(audit_id=latest.audit_id).first()
+        if obj is None:
+            return []
+        deltas = row_logs.after(latest.event.transaction.txid - 1).filter(
+            event__table_relid__table_name=model._meta.db_table, audit_id__in=[obj.audit_id])
+        queries = [('object history', row_logs.history_of(obj)), ('state deltas', deltas)]
+        queries = [(name, ) + queryset.query.sql_with_params() for name, queryset in queries]
+        queries.insert(1, ('history version', ) + history_cache.probe_sql(obj, True, self.connection))
+        return queries
+
+    def explain_all(self, title):
+        for name, sql, params in self.get_queries():
+            plan = self.fetch('EXPLAIN ' + sql, params)
+            self.stdout.write('-- %s (%s)' % (name, title))
+            self.stdout.write('\n'.join(row[0] for row in plan))
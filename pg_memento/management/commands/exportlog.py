@@ -0,0 +1,104 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils.dateparse import parse_datetime
+
+EXPORT_QUERY = """
+SELECT r.id, r.audit_id, e.op_id, e.table_operation, a.schema_name, a.table_name,
+       t.id AS transaction_id, t.txid, t.stmt_date, t.user_name, t.client_name, r.changes
+FROM pgmemento.row_log r
+JOIN pgmemento.table_event_log e ON e.id = r.event_id
+JOIN pgmemento.transaction_log t ON t.id = e.transaction_id
+JOIN pgmemento.audit_table_log a ON a.relid = e.table_relid
+{where}
+ORDER BY r.id
+"""
+
+CURSOR_NAME = 'pg_memento_export'
+
+
+class OutputStream(io.TextIOBase):
+    """ File-like view of the command's stdout, for COPY to write into """
+
+    def __init__(self, output):
+        self.output = output
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.output.write(data, ending='')
+        return len(data)
+
+
+class Command(BaseCommand):
+    help = 'Stream pgMemento row logs to JSON lines or CSV without loading them into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--output', dest='output', default=None,
+                            help='file to write to, defaults to stdout')
+        parser.add_argument('--table', dest='tables', action='append', default=[],
+                            help='only export changes of this table (repeatable)')
+        parser.add_argument('--since', dest='since', default=None,
+                            help='only export transactions at or after this ISO timestamp')
+        parser.add_argument('--until', dest='until', default=None,
+                            help='only export transactions before this ISO timestamp')
+        parser.add_argument('--from-txid', dest='from_txid', type=int, default=None)
+        parser.add_argument('--to-txid', dest='to_txid', type=int, default=None)
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=5000,
+                            help='rows fetched per round trip by the JSON lines export')
+        parser.add_argument('--database', dest='database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        sql, params = self.get_query(options)
+        connection = connections[options['database']]
+        output = io.open(options['output'], 'w', encoding='utf-8') if options['output'] else OutputStream(self.stdout)
+        try:
+            with transaction.atomic(using=connection.alias):
+                if options['format'] == 'csv':
+                    self.export_csv(connection, sql, params, output)
+                else:
+                    self.export_jsonl(connection, sql, params, output, options['batch_size'])
+        finally:
+            if options['output']:
+                output.close()
+
+    def get_query(self, options):
+        conditions, params = [], []
+        if options['tables']:
+            conditions.append('a.table_name = ANY(%s)')
+            params.append(options['tables'])
+        for option, condition in (('since', 't.stmt_date >= %s'), ('until', 't.stmt_date < %s')):
+            if options[option]:
+                value = parse_datetime(options[option])
+                if value is None:
+                    raise CommandError('--%s is not a valid ISO timestamp' % option)
+                conditions.append(condition)
+                params.append(value)
+        for option, condition in (('from_txid', 't.txid >= %s'), ('to_txid', 't.txid <= %s')):
+            if options[option] is not None:
+                conditions.append(condition)
+                params.append(options[option])
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return EXPORT_QUERY.format(where=where), params
+
+    def export_csv(self, connection, sql, params, output):
+        """ COPY streams straight from the server, parameters have to be inlined """
+        with connection.cursor() as cursor:
+            query = cursor.mogrify(sql, params)
+            if isinstance(query, bytes):
+                query = query.decode(connection.connection.encoding)
+            cursor.copy_expert('COPY (%s) TO STDOUT WITH CSV HEADER' % query, output)
+
+    def export_jsonl(self, connection, sql, params, output, batch_size):
+        """ A named cursor keeps the result set on the server and fetches `batch_size` rows at a time """
+        cursor = connection.connection.cursor(name=CURSOR_NAME)
+        cursor.itersize = batch_size
+        try:
+            cursor.execute('SELECT row_to_json(x)::text FROM (%s) x' % sql, params)
+            for row in cursor:
+                output.write(row[0] + '\n')
+        finally:
+            cursor.close()
@@ -1,16 +1,106 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.conf import settings
-from ._sql import init, uninit
-
-IGNORE_TABLES = ['reversion_revision',  # Don't see the need to log reversions in case it's installed
-                 'reversion_version']
+from django.db import connections
+from ._sql import (init, uninit, init_event_trigger, logged_tables, existing_tables, init_table, uninit_table,
+                   set_trigger_condition, trigger_condition, LOG_TRIGGERS, init_notify, uninit_notify)
+from ...conf import get_ignore_tables, get_lock_timeout, get_databases, get_schemas, get_notify_channel
+from ...registry import registry
 
 
 class Command(BaseCommand):
     help = 'Initialize pgMemento logging.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+                            help='only print the tables logging would be started or stopped on')
+        parser.add_argument('--prune', dest='prune', action='store_true', default=False,
+                            help='stop logging tables that no installed model has, e.g. of removed models')
+        parser.add_argument('--full', dest='full', action='store_true', default=False,
+                            help='drop and recreate logging on the whole schema at once')
+        parser.add_argument('--lock-timeout', dest='lock_timeout', default=get_lock_timeout(),
+                            help='how long to wait for a table lock, e.g. "2s" (PG_MEMENTO_LOCK_TIMEOUT)')
+        parser.add_argument('--retries', dest='retries', type=int, default=3,
+                            help='how many times to retry a table when its lock could not be taken')
+        parser.add_argument('--database', dest='databases', action='append', default=[],
+                            help='database alias to initialize (repeatable), defaults to PG_MEMENTO_DATABASES')
+        parser.add_argument('--schema', dest='schemas', action='append', default=[],
+                            help='schema to initialize (repeatable), defaults to PG_MEMENTO_SCHEMAS')
+
     def handle(self, *args, **options):
-        ignore_tables = getattr(settings, 'PG_MEMENTO_IGNORE_TABLES', IGNORE_TABLES)
-        uninit()
-        init(ignore_tables=ignore_tables)
+        # models configured not to be logged are ignored like PG_MEMENTO_IGNORE_TABLES
+        ignore_tables = list(get_ignore_tables()) + registry.get_opted_out_tables()
+        for using in options['databases'] or get_databases():
+            if using not in connections:
+                raise CommandError('Unknown database %s' % using)
+            for schema in options['schemas'] or get_schemas(using):
+                self.stdout.write('%s: %s' % (using, schema))
+                if options['full']:
+                    if not options['dry_run']:
+                        uninit(schema=schema, using=using)
+                        init(ignore_tables=ignore_tables, schema=schema, using=using)
+                else:
+                    self.sync(ignore_tables, schema, using, options)
+                self.sync_conditions(schema, using, options)
+            if not options['dry_run']:
+                channel = get_notify_channel()
+                if channel:
+                    init_notify(channel, using)
+                else:
+                    uninit_notify(using)
+                registry.invalidate()
+                registry.attach_audit_ids(connections[using])
         self.stdout.write(self.style.SUCCESS('Initialized!'))
+
+    def get_plan(self, ignore_tables, schema, using):
+        """
+        Tables of installed models that aren't logged yet, logged tables that
+        are ignored now, and logged tables that no installed model has
+        """
+        logged = logged_tables(schema, using)
+        existing = existing_tables(schema, using)
+        wanted = set(registry.get_loggable_tables()) & existing
+        to_add = sorted(wanted - logged)
+        to_drop = sorted(logged & set(ignore_tables))
+        orphaned = sorted(table for table in logged - set(ignore_tables)
+                          if registry.get_model_for_table(table) is None)
+        return to_add, to_drop, orphaned
+
+    def sync(self, ignore_tables, schema, using, options):
+        to_add, to_drop, orphaned = self.get_plan(ignore_tables, schema, using)
+        if options['prune']:
+            to_drop = sorted(to_drop + orphaned)
+        for table in to_add:
+            self.stdout.write('+ %s' % table)
+        for table in to_drop:
+            self.stdout.write('- %s' % table)
+        if not options['prune']:
+            for table in orphaned:
+                self.stdout.write('? %s (logged, but no installed model has it, --prune stops logging it)' % table)
+        if not to_add and not to_drop:
+            self.stdout.write('Nothing to change.')
+        if options['dry_run']:
+            return
+
+        init_event_trigger(using)
+        for table in to_add:
+            init_table(table, options['lock_timeout'], options['retries'], schema, using)
+        for table in to_drop:
+            uninit_table(table, options['lock_timeout'], options['retries'], schema, using)
+
+    def sync_conditions(self, schema, using, options):
+        """
+        Make the log triggers honour `suspend_logging`, and the update trigger
+        skip updates of excluded columns only
+        """
+        for table in sorted(logged_tables(schema, using)):
+            exclude_columns = registry.get_excluded_columns(table)
+            if options['dry_run']:
+                if exclude_columns:
+                    self.stdout.write('~ %s (not logged alone: %s)' % (table, ', '.join(exclude_columns)))
+                continue
+            changed = False
+            for trigger in LOG_TRIGGERS:
+                condition = trigger_condition(trigger, table, exclude_columns, schema)
+                changed |= set_trigger_condition(table, trigger, condition, options['lock_timeout'],
+                                                 options['retries'], schema, using)
+            if changed:
+                self.stdout.write('~ %s' % table)
@@ -0,0 +1,205 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+SCHEMA = 'pgmemento'
+PARTITION_KEY = 'stmt_date'
+
+# children first, so retention never leaves rows without their event or transaction
+LOG_TABLES = ('row_log', 'table_event_log', 'transaction_log')
+
+IS_PARTITIONED = """
+SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))
+"""
+
+FOREIGN_KEYS = """
+SELECT conrelid::regclass::text, conname FROM pg_constraint
+WHERE contype = 'f' AND (conrelid = to_regclass(%s) OR confrelid = to_regclass(%s))
+"""
+
+# every index but the primary key, with the constraint it backs and its columns
+INDEXES = """
+SELECT i.relname, pg_get_indexdef(x.indexrelid), x.indisunique, c.conname, pg_get_constraintdef(c.oid),
+       ARRAY(SELECT a.attname FROM pg_attribute a WHERE a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey))
+FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary
+ORDER BY i.relname
+"""
+
+SERIAL_SEQUENCE = "SELECT pg_get_serial_sequence(%s, 'id')"
+
+PARTITIONS = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass(%s)
+"""
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+# the time of the transaction each row of the child log tables belongs to
+BACKFILL_PARTITION_KEY = {
+    'row_log': """
+UPDATE {table} r SET {key} = t.stmt_date
+FROM {schema}.table_event_log e JOIN {schema}.transaction_log t ON t.id = e.transaction_id
+WHERE e.id = r.event_id""",
+    'table_event_log': """
+UPDATE {table} e SET {key} = t.stmt_date
+FROM {schema}.transaction_log t WHERE t.id = e.transaction_id""",
+}
+
+
+class Command(BaseCommand):
+    help = ('Convert the pgMemento log tables to daily range partitions on %s, create partitions ahead '
+            'and drop partitions older than PG_MEMENTO_RETENTION_DAYS. Requires PostgreSQL 11+.' % PARTITION_KEY)
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', metavar='table',
+                            help='log tables to partition, defaults to all of them (%s)' % ', '.join(LOG_TABLES))
+        parser.add_argument('--convert', dest='convert', action='store_true', default=False,
+                            help='convert the log tables to partitioned tables first (takes exclusive locks)')
+        parser.add_argument('--premake', dest='premake', type=int, default=7,
+                            help='number of daily partitions to keep created ahead')
+        parser.add_argument('--retention-days', dest='retention_days', type=int,
+                            default=getattr(settings, 'PG_MEMENTO_RETENTION_DAYS', None),
+                            help='drop partitions that only hold changes older than this')
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False)
+        parser.add_argument('--database', dest='database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.connection = connections[options['database']]
+        self.dry_run = options['dry_run']
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        unknown = set(options['tables']) - set(LOG_TABLES)
+        if unknown:
+            raise CommandError('Not a log table: %s' % ', '.join(sorted(unknown)))
+        tables = [table for table in LOG_TABLES if table in options['tables'] or not options['tables']]
+
+        if options['convert']:
+            tables_to_convert = [table for table in tables if not self.is_partitioned(table)]
+            # checked up front, so that no table is converted when any of them can't be
+            unsupported = ['%s: %s' % (table, name) for table in tables_to_convert
+                           for name in self.unsupported_indexes(table)]
+            if unsupported:
+                raise CommandError('Unique indexes must include %s to carry over to a partitioned table, '
+                                   'leave their tables unpartitioned: %s' % (PARTITION_KEY, ', '.join(unsupported)))
+            for table in tables_to_convert:
+                self.convert(table, today + datetime.timedelta(days=1))
+        for table in tables:
+            if self.dry_run or self.is_partitioned(table):
+                self.premake(table, today, options['premake'])
+
+        if options['retention_days'] is not None:
+            cutoff = timezone.now() - datetime.timedelta(days=options['retention_days'])
+            for table in tables:
+                self.drop_expired(table, cutoff)
+        self.stdout.write(self.style.SUCCESS('Done!'))
+
+    def qualified(self, table):
+        return '%s.%s' % (SCHEMA, table)
+
+    def execute(self, sql, params=None):
+        self.stdout.write(sql if not params else '%s -- %s' % (sql, params))
+        if not self.dry_run:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql, params)
+
+    def fetch(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def is_partitioned(self, table):
+        return self.fetch(IS_PARTITIONED, [self.qualified(table)])[0][0]
+
+    def indexes(self, table):
+        return self.fetch(INDEXES, [self.qualified(table)])
+
+    def unsupported_indexes(self, table):
+        """
+        Unique indexes and constraints without the partition key, which
+        PostgreSQL can't enforce across partitions. Widening them to include
+        it would break the ON CONFLICT clauses pgMemento relies on to log the
+        later statements of a transaction.
+        """
+        return [name for name, definition, unique, constraint, constraint_definition, columns in self.indexes(table)
+                if (unique or constraint) and PARTITION_KEY not in columns]
+
+    def convert(self, table, boundary):
+        """
+        Swap the table for a partitioned one and attach the old table as its first partition.
+
+        The old rows are given the time of their transaction, so retention
+        can expire them day by day (see `drop_expired`). The primary key has
+        to include the partition key; `id` stays unique through its sequence.
+        The other indexes and constraints are created again on the
+        partitioned table, under their original names.
+        """
+        qualified = self.qualified(table)
+        legacy = '%s_legacy' % table
+        indexes = self.indexes(table)
+        with transaction.atomic(using=self.connection.alias):
+            if table in BACKFILL_PARTITION_KEY:
+                self.execute('ALTER TABLE %s ADD COLUMN IF NOT EXISTS %s timestamptz' % (qualified, PARTITION_KEY))
+                self.execute(BACKFILL_PARTITION_KEY[table].format(table=qualified, key=PARTITION_KEY, schema=SCHEMA))
+                # rows whose event or transaction is gone count as changed now
+                self.execute('UPDATE %s SET %s = transaction_timestamp() WHERE %s IS NULL' % (
+                    qualified, PARTITION_KEY, PARTITION_KEY))
+                self.execute('ALTER TABLE %s ALTER COLUMN %s SET DEFAULT transaction_timestamp(), '
+                             'ALTER COLUMN %s SET NOT NULL' % (qualified, PARTITION_KEY, PARTITION_KEY))
+            # partitions are dropped independently, foreign keys between the log tables would block that
+            for constrained, name in self.fetch(FOREIGN_KEYS, [qualified, qualified]):
+                self.execute('ALTER TABLE %s DROP CONSTRAINT %s' % (constrained, name))
+            sequence = self.fetch(SERIAL_SEQUENCE, [qualified])[0][0]
+            self.execute('ALTER TABLE %s RENAME TO %s' % (qualified, legacy))
+            for name, definition, unique, constraint, constraint_definition, columns in indexes:
+                # renaming an index renames the constraint it backs along with it
+                self.execute('ALTER INDEX %s.%s RENAME TO %s_legacy' % (SCHEMA, name, name))
+            self.execute('CREATE TABLE %s (LIKE %s.%s INCLUDING DEFAULTS INCLUDING CONSTRAINTS, '
+                         'PRIMARY KEY (id, %s)) PARTITION BY RANGE (%s)' % (
+                             qualified, SCHEMA, legacy, PARTITION_KEY, PARTITION_KEY))
+            # attaching the old table below picks up its matching indexes instead of building new ones
+            for name, definition, unique, constraint, constraint_definition, columns in indexes:
+                if constraint:
+                    self.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (qualified, constraint, constraint_definition))
+                else:
+                    self.execute(definition)
+            if sequence:
+                self.execute('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, qualified))
+            self.execute("ALTER TABLE %s ATTACH PARTITION %s.%s FOR VALUES FROM (MINVALUE) TO ('%s')" % (
+                qualified, SCHEMA, legacy, boundary.isoformat()))
+
+    def partitions(self, table):
+        partitions = []
+        for name, bound in self.fetch(PARTITIONS, [self.qualified(table)]):
+            match = UPPER_BOUND.search(bound or '')
+            partitions.append((name, parse_datetime(match.group(1)) if match else None))
+        return partitions
+
+    def premake(self, table, today, days):
+        partitions = self.partitions(table)
+        existing = set(name for name, upper in partitions)
+        covered = max([upper for name, upper in partitions if upper] or [today])
+        for offset in range(days + 1):
+            start = today + datetime.timedelta(days=offset)
+            name = '%s_p%s' % (table, start.strftime('%Y%m%d'))
+            if name in existing or start < covered:
+                continue
+            self.execute("CREATE TABLE %s.%s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')" % (
+                SCHEMA, name, self.qualified(table), start.isoformat(),
+                (start + datetime.timedelta(days=1)).isoformat()))
+
+    def drop_expired(self, table, cutoff):
+        for name, upper in self.partitions(table):
+            if upper is not None and upper <= cutoff:
+                with transaction.atomic(using=self.connection.alias):
+                    self.execute('ALTER TABLE %s DETACH PARTITION %s.%s' % (self.qualified(table), SCHEMA, name))
+                    self.execute('DROP TABLE %s.%s' % (SCHEMA, name))
+            elif name == '%s_legacy' % table:
+                # the converted table spans all the days before the conversion
+                self.execute('DELETE FROM %s.%s WHERE %s < %%s' % (SCHEMA, name, PARTITION_KEY), [cutoff])
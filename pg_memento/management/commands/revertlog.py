@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...revert import revert_transaction_range
+
+
+class Command(BaseCommand):
+    help = 'Revert the changes made by a transaction, or a range of transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('transaction_id', type=int,
+                            help='transaction_log id to revert (the first one of a range)')
+        parser.add_argument('--to', dest='end_id', type=int, default=None,
+                            help='last transaction_log id of the range to revert')
+        parser.add_argument('--server', dest='server', action='store_true', default=False,
+                            help='revert with pgMemento\'s REVERT functions instead of the ORM')
+        parser.add_argument('--database', dest='database', default=None,
+                            help='database alias to revert on')
+
+    def handle(self, *args, **options):
+        start_id, end_id = options['transaction_id'], options['end_id']
+        if end_id is not None and end_id < start_id:
+            raise CommandError('--to must not be lower than transaction_id')
+        result = revert_transaction_range(start_id, end_id, using=options['database'], server=options['server'])
+        for table, counts in result.counts.items():
+            self.stdout.write("%s: %s" % (table, ", ".join(
+                "%d %s" % (number, operation) for operation, number in counts.items())))
+        self.stdout.write(self.style.SUCCESS('Reverted (%s)!' % result.backend))
@@ -0,0 +1,175 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS, ProgrammingError
+from django.utils.dateparse import parse_datetime
+
+from ...revert import UNDEFINED_FUNCTION
+
+AUDITED_TABLES = """
+SELECT table_name, schema_name, relid FROM pgmemento.audit_table_log
+WHERE upper_inf(txid_range) AND (%s OR table_name = ANY(%s))
+ORDER BY table_name
+"""
+
+# row_log changes hold the values before each change, so a row is as of the
+# cutoff when its current values are overlaid with the oldest value of every
+# column changed since; rows first inserted since did not exist yet
+SNAPSHOT = """
+INSERT INTO {target}
+WITH events AS (
+    SELECT e.id, e.op_id FROM pgmemento.table_event_log e
+    JOIN pgmemento.transaction_log t ON t.id = e.transaction_id
+    WHERE e.table_relid = %(relid)s AND {after}
+), changed AS (
+    SELECT DISTINCT ON (r.audit_id) r.audit_id, e.op_id AS first_op
+    FROM pgmemento.row_log r JOIN events e ON e.id = r.event_id
+    ORDER BY r.audit_id, r.id
+), old_values AS (
+    SELECT audit_id, jsonb_object_agg(key, value) AS changes FROM (
+        SELECT DISTINCT ON (r.audit_id, c.key) r.audit_id, c.key, c.value
+        FROM pgmemento.row_log r JOIN events e ON e.id = r.event_id, jsonb_each(r.changes) c
+        ORDER BY r.audit_id, c.key, r.id
+    ) v GROUP BY audit_id
+)
+SELECT src.* FROM {source} src
+WHERE NOT EXISTS (SELECT 1 FROM changed WHERE changed.audit_id = src.audit_id)
+UNION ALL
+SELECT (jsonb_populate_record(src, COALESCE(o.changes, '{{}}'::jsonb))).*
+FROM changed c
+LEFT JOIN {source} src ON src.audit_id = c.audit_id
+LEFT JOIN old_values o ON o.audit_id = c.audit_id
+WHERE c.first_op <> 1
+"""
+
+CREATE_SCHEMA = "CREATE SCHEMA IF NOT EXISTS {schema}"
+
+CREATE_TABLE = "CREATE TABLE {target} (LIKE {source})"
+
+DROP_TABLE = "DROP TABLE IF EXISTS {target}"
+
+# the transaction_log id of the last transaction up to the snapshot, for --pgmemento
+LAST_TRANSACTION = "SELECT COALESCE(max(id), 0) FROM pgmemento.transaction_log t WHERE {until}"
+
+# installed by the initial migration from pgMemento's src/VERSIONING.sql as restore_table_state(
+# start_from_tid, end_at_tid, original_table_name, original_schema_name, target_schema_name,
+# target_table_type, update_state), its `tid`s are transaction_log ids, not txids
+RESTORE_TABLE_STATE = "SELECT pgmemento.restore_table_state(1, %s, %s, %s, %s, 'TABLE', 0)"
+
+COUNT_ROWS = "SELECT count(*) FROM {target}"
+
+
+def close_connections():
+    """ Forked workers must not share the connections of their parent """
+    for connection in connections.all():
+        connection.close()
+
+
+def snapshot_table(task):
+    """ Write one table as of the cutoff, returns (table, rows, seconds) """
+    table, schema, relid, options = task
+    connection = connections[options['database']]
+    qn = connection.ops.quote_name
+    source = '%s.%s' % (qn(schema), qn(table))
+    target = '%s.%s' % (qn(options['schema']), qn(table + options['suffix']))
+    started = time.time()
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            if options['replace']:
+                cursor.execute(DROP_TABLE.format(target=target))
+            if options['pgmemento']:
+                cursor.execute(LAST_TRANSACTION.format(until=options['until']), [options['as_of']])
+                cursor.execute(RESTORE_TABLE_STATE, [cursor.fetchone()[0], table, schema, options['schema']])
+                cursor.execute(COUNT_ROWS.format(target=target))
+                rows = cursor.fetchone()[0]
+            else:
+                cursor.execute(CREATE_TABLE.format(target=target, source=source))
+                cursor.execute(SNAPSHOT.format(target=target, source=source, after=options['after']),
+                               {'relid': relid, 'as_of': options['as_of']})
+                rows = cursor.rowcount
+    return table, rows, time.time() - started
+
+
+class Command(BaseCommand):
+    help = ('Write audited tables as they were at a txid or point in time into new tables, '
+            'rebuilt set-based from the row log in one worker process per table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', metavar='table',
+                            help='audited tables to snapshot, defaults to all of them')
+        parser.add_argument('--txid', dest='txid', type=int, default=None,
+                            help='snapshot the state after this transaction id')
+        parser.add_argument('--at', dest='at', default=None,
+                            help='snapshot the state at this ISO timestamp')
+        parser.add_argument('--schema', dest='schema', default='pgmemento_snapshot',
+                            help='schema to create the snapshot tables in')
+        parser.add_argument('--suffix', dest='suffix', default='',
+                            help='appended to the table names, e.g. to snapshot next to the originals')
+        parser.add_argument('--replace', dest='replace', action='store_true', default=False,
+                            help='drop snapshot tables that already exist')
+        parser.add_argument('--jobs', dest='jobs', type=int, default=multiprocessing.cpu_count(),
+                            help='number of tables snapshotted in parallel')
+        parser.add_argument('--pgmemento', dest='pgmemento', action='store_true', default=False,
+                            help='use pgMemento\'s restore_table_state function instead')
+        parser.add_argument('--database', dest='database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        options.update(self.get_cutoff(options))
+        if options['pgmemento'] and options['suffix']:
+            raise CommandError('--suffix is not supported by pgMemento\'s restore_table_state')
+
+        connection = connections[options['database']]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(AUDITED_TABLES, [not options['tables'], options['tables']])
+            tables = cursor.fetchall()
+            missing = set(options['tables']) - set(table for table, schema, relid in tables)
+            if missing:
+                raise CommandError('Not audited: %s' % ', '.join(sorted(missing)))
+            for table, schema, relid in tables:
+                if schema == options['schema'] and not options['suffix']:
+                    raise CommandError('%s would be overwritten by its own snapshot, '
+                                       'use another --schema or a --suffix' % table)
+            cursor.execute(CREATE_SCHEMA.format(schema=qn(options['schema'])))
+
+        task_options = dict((key, options[key]) for key in (
+            'database', 'schema', 'suffix', 'replace', 'pgmemento', 'as_of', 'after', 'until'))
+        tasks = [(table, schema, relid, task_options) for table, schema, relid in tables]
+        started = time.time()
+        try:
+            for table, rows, seconds in self.run(tasks, options['jobs']):
+                self.stdout.write('%s: %d rows in %.2fs (%d rows/s)' % (
+                    table, rows, seconds, rows / seconds if seconds else rows))
+        except ProgrammingError as e:
+            if getattr(e.__cause__, 'pgcode', None) == UNDEFINED_FUNCTION:
+                raise CommandError('pgMemento\'s restore_table_state is not installed, snapshot without --pgmemento')
+            raise CommandError(e)
+        seconds = time.time() - started
+        self.stdout.write(self.style.SUCCESS('Snapshotted %d tables into %s in %.2fs' % (
+            len(tasks), options['schema'], seconds)))
+
+    def get_cutoff(self, options):
+        """ The conditions on transaction_log `t` for changes after, and up to, the snapshot """
+        if (options['txid'] is None) == (options['at'] is None):
+            raise CommandError('Pass either --txid or --at')
+        if options['txid'] is not None:
+            return {'as_of': options['txid'], 'after': 't.txid > %(as_of)s', 'until': 't.txid <= %s'}
+        as_of = parse_datetime(options['at'])
+        if as_of is None:
+            raise CommandError('--at is not a valid ISO timestamp')
+        return {'as_of': as_of, 'after': 't.stmt_date > %(as_of)s', 'until': 't.stmt_date <= %s'}
+
+    def run(self, tasks, jobs):
+        if jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield snapshot_table(task)
+            return
+        close_connections()
+        pool = multiprocessing.Pool(min(jobs, len(tasks)), initializer=close_connections)
+        try:
+            for result in pool.imap_unordered(snapshot_table, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
@@ -1,10 +1,25 @@
 from django.core.management.base import BaseCommand, CommandError
-from ._sql import init, uninit
+from django.db import connections
+from ._sql import init, uninit, uninit_notify
+from ...conf import get_databases, get_schemas
+from ...registry import registry
 
 
 class Command(BaseCommand):
     help = 'Uninitialize pgMemento logging.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--database', dest='databases', action='append', default=[],
+                            help='database alias to uninitialize (repeatable), defaults to PG_MEMENTO_DATABASES')
+        parser.add_argument('--schema', dest='schemas', action='append', default=[],
+                            help='schema to uninitialize (repeatable), defaults to PG_MEMENTO_SCHEMAS')
+
     def handle(self, *args, **options):
-        uninit()
+        for using in options['databases'] or get_databases():
+            if using not in connections:
+                raise CommandError('Unknown database %s' % using)
+            for schema in options['schemas'] or get_schemas(using):
+                uninit(schema=schema, using=using)
+            uninit_notify(using)
+        registry.invalidate()
         self.stdout.write(self.style.SUCCESS('Uninitialized!'))
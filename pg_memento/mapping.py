@@ -0,0 +1,77 @@
+import threading
+
+from django.core.exceptions import ValidationError
+
+_mappers = {}
+_lock = threading.Lock()
+
+
+class ColumnMapper(object):
+    """
+    Turns RowLog `changes`, JSON values keyed by db column, into model attribute values.
+
+    Built once per model from its concrete fields: custom `db_column`s and
+    foreign key `attname`s are resolved, and values are converted by the
+    field's `to_python`, so dates, decimals, UUIDs and the like come out as
+    Python objects. Values the field can't convert are passed on as they are.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = dict((f.column, (f.attname, f.to_python)) for f in model._meta.concrete_fields)
+
+    @property
+    def columns(self):
+        return set(self.fields)
+
+    @property
+    def attnames(self):
+        """ db column -> attribute name """
+        return dict((column, attname) for column, (attname, to_python) in self.fields.items())
+
+    def decode(self, changes):
+        """ Attribute name -> Python value for the known columns of a `changes` dict """
+        values = {}
+        if not isinstance(changes, dict):
+            return values
+        fields = self.fields
+        for column, value in changes.items():
+            field = fields.get(column)
+            if field is None:
+                continue
+            attname, to_python = field
+            if value is not None:
+                try:
+                    value = to_python(value)
+                except ValidationError:
+                    pass
+            values[attname] = value
+        return values
+
+    def decode_many(self, changes_list):
+        decode = self.decode
+        return [decode(changes) for changes in changes_list]
+
+    def apply(self, obj, changes):
+        """ Set the decoded `changes` on `obj`, returns the attribute names set """
+        values = self.decode(changes)
+        for attname, value in values.items():
+            setattr(obj, attname, value)
+        return list(values)
+
+
+def get_mapper(model):
+    """ The ColumnMapper of `model`, built on first use """
+    mapper = _mappers.get(model)
+    if mapper is None:
+        with _lock:
+            mapper = _mappers.get(model)
+            if mapper is None:
+                mapper = _mappers[model] = ColumnMapper(model)
+    return mapper
+
+
+def forget_mapper(model):
+    """ Drop the cached mapper, after fields were added to the model """
+    with _lock:
+        _mappers.pop(model, None)
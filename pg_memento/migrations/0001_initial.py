@@ -1,22 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import os
-import sys
 from django.db import migrations
 from pg_memento.compat import PG_MEMENTO_PATH, read_file_content
+from pg_memento.conf import get_databases
 
-from django.conf import settings
-
-
-TESTING = os.environ.get('IS_TEST') == 'true'
-
-db_to_log = settings.DATABASES.get('default')
-# TODO: allow multiple databases
-assert db_to_log is not None, "missing 'default' database!"
-assert 'postgresql' in db_to_log.get('ENGINE'), "Only PostreSQL engine is supported!"
-db_name = db_to_log.get('NAME')
-if TESTING:
-    db_name = db_to_log.get('TEST', {}).get('NAME', db_name)
 
 SETUP = 'src/SETUP.sql'
 LOG_UTILS = 'src/LOG_UTIL.sql'
@@ -34,16 +22,6 @@ ALTER DATABASE {} SET search_path TO "$user", public, pgmemento;
 """
 
 
-INSTALL_PG_MEMENTO = [
-    read_file_content(os.path.join(PG_MEMENTO_PATH, SETUP)),
-    read_file_content(os.path.join(PG_MEMENTO_PATH, LOG_UTILS)),
-    read_file_content(os.path.join(PG_MEMENTO_PATH, DDL_LOG)),
-    read_file_content(os.path.join(PG_MEMENTO_PATH, VERSIONING)),
-    read_file_content(os.path.join(PG_MEMENTO_PATH, REVERT)),
-    read_file_content(os.path.join(PG_MEMENTO_PATH, SCHEMA_MANAGEMENT)),
-    FINISH_INSTALL.format(db_name)
-]
-
 UNINSTALL_PG_MEMENTO = """
 -- UNINSTALL_PGMEMENTO.sql
 
@@ -56,12 +34,38 @@ ALTER DATABASE {} SET search_path TO "$user", public;
 """
 
 
+def is_logged_database(schema_editor):
+    """ pgMemento is installed on every database listed in PG_MEMENTO_DATABASES """
+    connection = schema_editor.connection
+    if connection.alias not in get_databases():
+        return False
+    assert connection.vendor == 'postgresql', "Only PostreSQL engine is supported!"
+    return True
+
+
+def db_name(schema_editor):
+    # the test runner swaps in the test database name
+    return schema_editor.connection.ops.quote_name(schema_editor.connection.settings_dict['NAME'])
+
+
+def install(apps, schema_editor):
+    if not is_logged_database(schema_editor):
+        return
+    for script in (SETUP, LOG_UTILS, DDL_LOG, VERSIONING, REVERT, SCHEMA_MANAGEMENT):
+        schema_editor.execute(read_file_content(os.path.join(PG_MEMENTO_PATH, script)), params=None)
+    schema_editor.execute(FINISH_INSTALL.format(db_name(schema_editor)), params=None)
+
+
+def uninstall(apps, schema_editor):
+    if not is_logged_database(schema_editor):
+        return
+    schema_editor.execute(UNINSTALL_PG_MEMENTO.format(db_name(schema_editor)), params=None)
+
+
 class Migration(migrations.Migration):
 
     dependencies = []
 
     operations = [
-        migrations.RunSQL(
-            sql=INSTALL_PG_MEMENTO,
-            reverse_sql=[UNINSTALL_PG_MEMENTO.format(db_name)])
+        migrations.RunPython(install, reverse_code=uninstall)
     ]
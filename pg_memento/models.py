@@ -1,8 +1,14 @@
-from django.db import models
-import django.apps
+import datetime
+import json
+
+from django.db import models, connections
+from django.db.models.expressions import Expression
 from django.core.exceptions import FieldDoesNotExist
 from django.contrib.postgres.fields import FloatRangeField, JSONField
 
+from .mapping import get_mapper, forget_mapper
+from .schema import schema_history
+
 
 class ReadOnlyModel(models.Model):
 
@@ -101,6 +107,176 @@ class NonManagedTable(Exception):
     pass
 
 
+# table_event_log.op_id values of row level events
+INSERT, UPDATE, DELETE = 1, 2, 3
+
+# op_id of the summary events written by `suspend_logging`
+SUSPENDED = 0
+
+
+class RowState(object):
+    """ The state of a single audited row before a series of deltas """
+
+    def __init__(self, audit_id):
+        self.audit_id = audit_id
+        self.values = {}
+        self.row_log_ids = []
+        self.first_op = None
+        self.has_full_row = False
+
+    def fold(self, op_id, changes, row_log_id):
+        """ Fold in a delta that is older than every delta folded in so far """
+        self.row_log_ids.append(row_log_id)
+        self.first_op = op_id
+        if op_id == DELETE:
+            self.has_full_row = True
+        if isinstance(changes, dict):
+            self.values.update(changes)
+
+    @property
+    def exists(self):
+        """ Whether the row exists once reverted """
+        return self.first_op != INSERT
+
+
+def get_field_mapping(model):
+    """ Map db column names, as found in RowLog.changes, to model attribute names """
+    return get_mapper(model).attnames
+
+
+HISTORY_OWN_ROWS = """
+SELECT r.id FROM {row_log} r
+JOIN {table_event_log} e ON e.id = r.event_id
+JOIN {audit_table_log} a ON a.relid = e.table_relid
+WHERE a.table_name = %s AND r.audit_id = %s
+"""
+
+# every change of m2m rows relating to the object: the current ones and the ones deleted since
+HISTORY_M2M_ROWS = """
+SELECT r.id FROM {row_log} r
+JOIN {table_event_log} e ON e.id = r.event_id
+JOIN {audit_table_log} a ON a.relid = e.table_relid
+WHERE a.table_name = %s AND r.audit_id IN (
+    SELECT t.audit_id FROM {through} t WHERE t.{column} = %s
+    UNION
+    SELECT r2.audit_id FROM {row_log} r2
+    JOIN {table_event_log} e2 ON e2.id = r2.event_id
+    JOIN {audit_table_log} a2 ON a2.relid = e2.table_relid
+    WHERE a2.table_name = %s AND r2.changes @> %s::jsonb
+)
+"""
+
+# the newest `limit` RowLogs of each of many rows of a table
+LATEST_ROWS = """
+SELECT latest.id FROM (
+    SELECT r.id, row_number() OVER (PARTITION BY r.audit_id ORDER BY r.id DESC) AS position
+    FROM {row_log} r
+    JOIN {table_event_log} e ON e.id = r.event_id
+    JOIN {audit_table_log} a ON a.relid = e.table_relid
+    WHERE a.table_name = %s AND r.audit_id = ANY(%s)
+) latest WHERE {position}
+"""
+
+
+class RowLogQuerySet(models.QuerySet):
+
+    def history_of(self, obj, include_m2m=True):
+        """
+        RowLogs of `obj` and, optionally, of its many-to-many relations, present and deleted.
+
+        Built as a single UNION ALL subquery, so it can be filtered further like any queryset.
+        """
+        model = type(obj)
+        qn = connections[self.db].ops.quote_name
+        tables = dict(row_log=qn(RowLog._meta.db_table),
+                      table_event_log=qn(TableEventLog._meta.db_table),
+                      audit_table_log=qn(AuditTableLog._meta.db_table))
+
+        parts = [HISTORY_OWN_ROWS.format(**tables)]
+        params = [model._meta.db_table, obj.audit_id]
+        if include_m2m:
+            for m2m_field in model._meta.many_to_many:
+                through_table = m2m_field.remote_field.through._meta.db_table
+                column = m2m_field.m2m_column_name()
+                parts.append(HISTORY_M2M_ROWS.format(through=qn(through_table), column=qn(column), **tables))
+                params.extend([through_table, obj.pk, through_table, json.dumps({column: obj.pk})])
+
+        where = '%s.%s IN (%s)' % (tables['row_log'], qn('id'), 'UNION ALL'.join(parts))
+        return self.extra(where=[where], params=params)
+
+    def after(self, as_of):
+        """ RowLogs of transactions later than `as_of`, a datetime or a txid """
+        if isinstance(as_of, datetime.datetime):
+            transactions = TransactionLog.objects.filter(stmt_date__gt=as_of)
+        else:
+            transactions = TransactionLog.objects.filter(txid__gt=as_of)
+        return self.filter(event__transaction_id__in=transactions.values('id'))
+
+    def states_of(self, model, audit_ids, as_of):
+        """
+        Rebuild rows of `model` as they were at `as_of`, without writing anything.
+
+        The deltas logged after `as_of` are folded, newest first, over the
+        current rows. Returns a dict of audit_id -> unsaved instance, or None
+        for rows that did not exist at that time. Costs one query for the
+        deltas and one for the current rows that are still needed.
+        """
+        audit_ids = list(audit_ids)
+        states = {}
+        deltas = self.after(as_of).filter(event__table_relid__table_name=model._meta.db_table,
+                                          audit_id__in=audit_ids)
+        for audit_id, op_id, changes, row_log_id, relid, txid in deltas.order_by('-id').values_list(
+                'audit_id', 'event__op_id', 'changes', 'id', 'event__table_relid_id',
+                'event__transaction__txid').iterator():
+            state = states.get(audit_id)
+            if state is None:
+                state = states[audit_id] = RowState(audit_id)
+            state.fold(op_id, schema_history.translate(relid, txid, changes), row_log_id)
+
+        # rows that were only updated since, or not changed at all, start off their current values
+        needs_current = [audit_id for audit_id in audit_ids
+                         if audit_id not in states or (states[audit_id].exists and not states[audit_id].has_full_row)]
+        current = {}
+        if needs_current:
+            current = dict((obj.audit_id, obj) for obj in model._default_manager.filter(audit_id__in=needs_current))
+
+        mapper = get_mapper(model)
+        result = {}
+        for audit_id in audit_ids:
+            state = states.get(audit_id)
+            obj = current.get(audit_id)
+            if state is not None:
+                if not state.exists or (obj is None and not state.has_full_row):
+                    obj = None
+                else:
+                    obj = obj or model()
+                    mapper.apply(obj, state.values)
+            result[audit_id] = obj
+        return result
+
+    def state_of(self, model_or_instance, as_of, audit_id=None):
+        """ `states_of` for a single row, given an instance or a model and audit_id """
+        if isinstance(model_or_instance, models.Model):
+            model, audit_id = type(model_or_instance), model_or_instance.audit_id
+        else:
+            model = model_or_instance
+        return self.states_of(model, [audit_id], as_of)[audit_id]
+
+    def latest_of(self, model, audit_ids, limit=None):
+        """ The newest `limit` (or all) RowLogs of every row of `model` in `audit_ids`, in one query """
+        qn = connections[self.db].ops.quote_name
+        tables = dict(row_log=qn(RowLog._meta.db_table),
+                      table_event_log=qn(TableEventLog._meta.db_table),
+                      audit_table_log=qn(AuditTableLog._meta.db_table))
+        params = [model._meta.db_table, list(audit_ids)]
+        position = 'TRUE'
+        if limit is not None:
+            position = 'latest.position <= %s'
+            params.append(limit)
+        where = '%s.%s IN (%s)' % (tables['row_log'], qn('id'), LATEST_ROWS.format(position=position, **tables))
+        return self.extra(where=[where], params=params)
+
+
 class RowLog(ReadOnlyModel):
 
     id = models.BigIntegerField(primary_key=True)
@@ -108,6 +284,8 @@ class RowLog(ReadOnlyModel):
     audit_id = models.IntegerField()
     changes = JSONField()
 
+    objects = RowLogQuerySet.as_manager()
+
     class Meta:
         managed = False
         db_table = 'row_log'
@@ -121,35 +299,30 @@ class RowLog(ReadOnlyModel):
     @property
     def subject_model(self):
         if self._subject_model is None:
-            all_models = django.apps.apps.get_models(include_auto_created=True)
-
-            # find the model with corresponding db_table
-            db_table = self.event.table_relid.table_name
-            m = None
-            for model in all_models:
-                if model._meta.db_table == db_table:
-                    m = model
-                    break
-            if m is None:
+            from .registry import registry
+
+            # resolve by relid, so the AuditTableLog row itself is never fetched
+            m = registry.get_model_for_relid(self.event.table_relid_id)
+            if m is None or not registry.is_audited(m):
                 # TODO: Handle this case
                 raise NonManagedTable("Irreversible: The table is not managed by any installed app")
-            add_audit_id(m)
             self._subject_model = m
 
         return self._subject_model
 
     @property
     def field_mapping(self):
-        model = self.subject_model
-        # TODO: Test mapping under various circumstances (ex. custom db_column, foreign_key, etc.)
-        return dict([(getattr(f, 'column', None) or
-                      getattr(f, 'attname', None) or
-                      f.name, getattr(f, 'attname', None) or f.name) for f in model._meta.get_fields()])
+        return get_field_mapping(self.subject_model)
+
+    @property
+    def current_changes(self):
+        """ `changes` keyed by the table's current column names, following renames since they were logged """
+        event = self.event
+        return schema_history.translate(event.table_relid_id, event.transaction.txid, self.changes)
 
     @property
     def subject(self):
         model = self.subject_model
-        add_audit_id(model)
         try:
             obj = model.objects.get(audit_id=self.audit_id)
             return obj
@@ -157,13 +330,10 @@ class RowLog(ReadOnlyModel):
             pass
 
     def subject_update(self, obj):
-        mapping = self.field_mapping
-        changes = self.changes
-        if isinstance(changes, dict):
-            for col, value in changes.items():
-                if col in mapping:
-                    setattr(obj, mapping.get(col), value)
-            obj.save()
+        update_fields = [attname for attname in get_mapper(self.subject_model).apply(obj, self.current_changes)
+                         if attname != obj._meta.pk.attname]
+        if update_fields:
+            obj.save(update_fields=update_fields)
 
     def revert(self):
 
@@ -178,25 +348,114 @@ class RowLog(ReadOnlyModel):
             if subject is not None:
                 self.subject_update(subject)
         elif event.op_id == 3:  # DELETE
-            mapping = self.field_mapping
-            changes = self.changes
             model = self.subject_model
 
             subject = self.subject
             if subject is not None:
                 self.subject_update(subject)
             else:
-                kwargs = {}
-                for col, value in changes.items():
-                    if col in mapping:
-                        kwargs[mapping[col]] = value
-                subject = model(**kwargs)
-                subject.save()
+                subject = model(**get_mapper(model).decode(self.current_changes))
+                subject.save(force_insert=True)
+
+
+def prefetch_history(objects, limit=None, to_attr='history'):
+    """
+    Set `to_attr` of every one of `objects`, instances of one audited model,
+    to its newest `limit` (or all) RowLogs, newest first, with their event,
+    transaction and table. Costs a single query however many objects there are.
+    Changes of many-to-many relations are not included, and objects without
+    an `audit_id` get an empty history.
+    """
+    objects = list(objects)
+    by_audit_id = {}
+    for obj in objects:
+        setattr(obj, to_attr, [])
+        if obj.audit_id is not None:
+            by_audit_id.setdefault(obj.audit_id, []).append(obj)
+    if not by_audit_id:
+        return objects
+    model = type(objects[0])
+    row_logs = RowLog.objects.latest_of(model, by_audit_id, limit).select_related(
+        'event__transaction', 'event__table_relid').order_by('-id')
+    for row_log in row_logs:
+        for obj in by_audit_id.get(row_log.audit_id, ()):
+            getattr(obj, to_attr).append(row_log)
+    return objects
+
+
+class HistoryQuerySet(models.QuerySet):
+    """
+    QuerySet of an audited model that can attach the objects' history::
+
+        class Product(models.Model):
+            ...
+            objects = HistoryQuerySet.as_manager()
+
+        for product in Product.objects.all()[:200].prefetch_history(limit=1):
+            product.history  # [the newest RowLog]
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(HistoryQuerySet, self).__init__(*args, **kwargs)
+        self._history_prefetch = None
+        self._history_done = False
+
+    def prefetch_history(self, limit=None, to_attr='history'):
+        clone = self._clone()
+        clone._history_prefetch = (limit, to_attr)
+        return clone
+
+    def _clone(self, **kwargs):
+        clone = super(HistoryQuerySet, self)._clone(**kwargs)
+        clone._history_prefetch = self._history_prefetch
+        return clone
+
+    def _fetch_all(self):
+        super(HistoryQuerySet, self)._fetch_all()
+        if self._history_prefetch and not self._history_done:
+            instances = [obj for obj in self._result_cache if isinstance(obj, models.Model)]
+            limit, to_attr = self._history_prefetch
+            prefetch_history(instances, limit=limit, to_attr=to_attr)
+            self._history_done = True
+
+
+class DatabaseDefault(Expression):
+    """ Lets postgres fill in the column default on INSERT """
+
+    def as_sql(self, compiler, connection):
+        return 'DEFAULT', []
+
+
+class AuditIdField(models.BigIntegerField):
+    """
+    The `audit_id` column pgMemento adds to every logged table.
+
+    New rows get their id from the column default.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.update(name='audit_id', db_column='audit_id', editable=False, null=True, blank=True)
+        super(AuditIdField, self).__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = super(AuditIdField, self).pre_save(model_instance, add)
+        if add and value is None:
+            return DatabaseDefault()
+        return value
 
 
 def add_audit_id(sender, **kwargs):
+    """
+    Attach an AuditIdField to `sender`.
+
+    The column is owned by pgMemento, not by the app's migrations, so the
+    field is added as a virtual field: migration states are built from local
+    fields only, while queries still select and filter on it like any other
+    concrete column.
+    """
     try:
         sender._meta.get_field('audit_id')
     except FieldDoesNotExist:
-        field = models.BigIntegerField(null=True, blank=True)
-        field.contribute_to_class(sender, 'audit_id')
+        field = AuditIdField()
+        field.contribute_to_class(sender, 'audit_id', virtual_only=True)
+        forget_mapper(sender)
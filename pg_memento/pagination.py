@@ -0,0 +1,137 @@
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+
+# partitioned tables (see the partitionlog command) only have estimates on their partitions
+ESTIMATE_COUNT = """
+SELECT coalesce(sum(reltuples) FILTER (WHERE reltuples > 0), 0)::bigint FROM pg_class
+WHERE oid = to_regclass(%s) OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+"""
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts a whole log table.
+
+    Unfiltered lists use the planner estimate from `pg_class.reltuples`.
+    Filtered lists are counted exactly, but only up to `exact_count_limit`
+    rows; wider filters report the limit and are flagged as estimated.
+    """
+
+    exact_count_limit = 10000
+
+    def __init__(self, *args, **kwargs):
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+        self.estimated = False
+
+    @property
+    def filtered(self):
+        return bool(self.object_list.query.where)
+
+    def estimate_count(self):
+        model = self.object_list.model
+        with connections[self.object_list.db].cursor() as cursor:
+            cursor.execute(ESTIMATE_COUNT, [model._meta.db_table, model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _get_count(self):
+        if self._count is None:
+            if not self.filtered:
+                self._count = self.estimate_count()
+                self.estimated = True
+            else:
+                count = self.object_list[:self.exact_count_limit + 1].count()
+                self.estimated = count > self.exact_count_limit
+                self._count = min(count, self.exact_count_limit)
+        return self._count
+    count = property(_get_count)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages on the primary key instead of OFFSET.
+
+    Pages are addressed by `?after=<pk>` (older rows) and `?before=<pk>`
+    (newer rows), so every page costs the same no matter how deep it is.
+    Custom orderings fall back to the regular page-number pagination.
+    """
+
+    cursor_params = (AFTER_VAR, BEFORE_VAR)
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = self._cursor(request, AFTER_VAR)
+        self.before = self._cursor(request, BEFORE_VAR)
+        self.keyset = False
+        self.prev_cursor = self.next_cursor = None
+        super(KeysetChangeList, self).__init__(request, *args, **kwargs)
+
+    @staticmethod
+    def _cursor(request, param):
+        try:
+            return int(request.GET[param])
+        except (KeyError, ValueError):
+            return None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(KeysetChangeList, self).get_filters_params(params)
+        for param in self.cursor_params:
+            lookup_params.pop(param, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # any other change of the list starts over from the newest rows
+        remove = list(remove or []) + [p for p in self.cursor_params if p not in (new_params or {})]
+        return super(KeysetChangeList, self).get_query_string(new_params, remove)
+
+    def use_keyset(self, request):
+        return ORDER_VAR not in self.params and not self.model_admin.get_ordering(request) and not self.show_all
+
+    def get_results(self, request):
+        if not self.use_keyset(request):
+            return super(KeysetChangeList, self).get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        per_page = self.list_per_page
+        queryset = self.queryset
+        if self.before is not None:
+            page = list(queryset.filter(pk__gt=self.before).order_by('pk')[:per_page + 1])
+            has_older, has_newer = True, len(page) > per_page
+            page = page[:per_page][::-1]
+        else:
+            if self.after is not None:
+                queryset = queryset.filter(pk__lt=self.after)
+            page = list(queryset[:per_page + 1])
+            has_older, has_newer = len(page) > per_page, self.after is not None
+            page = page[:per_page]
+
+        self.keyset = True
+        self.next_cursor = page[-1].pk if page and has_older else None
+        self.prev_cursor = page[0].pk if page and has_newer else None
+
+        result_count = paginator.count
+        self.result_count = result_count
+        self.result_count_estimated = getattr(paginator, 'estimated', False)
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = True
+        if not self.show_full_result_count:
+            self.full_result_count = None
+        elif isinstance(paginator, EstimatedCountPaginator) and paginator.filtered:
+            self.full_result_count = paginator.estimate_count()
+        else:
+            self.full_result_count = result_count
+        self.result_list = page
+        self.can_show_all = False
+        self.multi_page = has_older or has_newer
+        self.paginator = paginator
+
+    @property
+    def newer_query_string(self):
+        return self.get_query_string({BEFORE_VAR: self.prev_cursor})
+
+    @property
+    def older_query_string(self):
+        return self.get_query_string({AFTER_VAR: self.next_cursor})
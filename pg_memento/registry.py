@@ -0,0 +1,197 @@
+import threading
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, router
+
+AUDITED_TABLES = "SELECT table_name FROM pgmemento.audit_table_log WHERE upper_inf(txid_range)"
+
+HAS_AUDIT_LOG = "SELECT to_regclass('pgmemento.audit_table_log') IS NOT NULL"
+
+
+class SubjectRegistry(object):
+    """
+    Process-wide lookup of the installed models behind audited tables.
+
+    Tables and model names are indexed once, when the app registry is ready.
+    Models whose tables `initlogging` would log are given their `audit_id`
+    field on the first connection, once it shows which of them are actually
+    logged (AuditTableLog), so no query ever selects a column that is not
+    there yet. Until pgMemento is installed, every new connection checks
+    again.
+
+    AuditTableLog relids are loaded lazily on first use and reloaded whenever
+    an unknown relid shows up, or after `invalidate()` (called on
+    `post_migrate` and by the logging management commands).
+
+    Which models are logged, and which of their columns don't count as a
+    change, is set by a `PgMementoMeta` inner class on the model, overridden
+    by the PG_MEMENTO_MODELS setting::
+
+        class Visitor(models.Model):
+            ...
+
+            class PgMementoMeta:
+                log = True
+                exclude_columns = ['last_seen', 'visits']
+
+    Auto-created m2m tables follow the model that declares them.
+    """
+
+    def __init__(self):
+        self._by_table = {}
+        self._by_name = {}
+        self._by_relid = None
+        self._candidates = {}
+        self._excluded_columns = {}
+        self._opted_out = set()
+        self._audited = set()
+        self._attached = False
+        self._attaching = False
+        self._lock = threading.RLock()
+
+    def populate(self):
+        from .conf import get_ignore_tables, get_model_options, is_opt_in
+
+        ignore_tables = set(get_ignore_tables())
+        model_options = get_model_options()
+        log_default = not is_opt_in()
+        by_table = {}
+        by_name = {}
+        candidates = {}
+        excluded_columns = {}
+        opted_out = set()
+        for model in apps.get_models(include_auto_created=True):
+            opts = model._meta
+            if opts.proxy:
+                continue
+            by_table.setdefault(opts.db_table, model)
+            by_name.setdefault(opts.model_name, model)
+            by_name.setdefault('%s.%s' % (opts.app_label, opts.model_name), model)
+            if opts.managed and opts.app_label != 'pg_memento' and opts.db_table not in ignore_tables:
+                options = self.get_model_options(model, model_options, log_default)
+                if not options.get('log', log_default):
+                    opted_out.add(opts.db_table)
+                    continue
+                candidates.setdefault(opts.db_table, model)
+                excluded_columns[opts.db_table] = self.get_columns(model, options.get('exclude_columns', ()))
+        with self._lock:
+            self._by_table = by_table
+            self._by_name = by_name
+            self._by_relid = None
+            self._candidates = candidates
+            self._excluded_columns = excluded_columns
+            self._opted_out = opted_out
+
+    @staticmethod
+    def get_model_options(model, model_options, log_default):
+        """ `PgMementoMeta` of the model, updated by its PG_MEMENTO_MODELS entry """
+        opts = model._meta
+        options = {}
+        if opts.auto_created:
+            # m2m tables are logged along with the model that declares them
+            parent = SubjectRegistry.get_model_options(opts.auto_created, model_options, log_default)
+            options['log'] = parent.get('log', log_default)
+        meta = getattr(model, 'PgMementoMeta', None)
+        for name in ('log', 'exclude_columns'):
+            if hasattr(meta, name):
+                options[name] = getattr(meta, name)
+        options.update(model_options.get('%s.%s' % (opts.app_label, opts.model_name), {}))
+        return options
+
+    @staticmethod
+    def get_columns(model, names):
+        """ Column names, given field or column names """
+        columns = []
+        for name in names:
+            try:
+                columns.append(getattr(model._meta.get_field(name), 'column', None) or name)
+            except FieldDoesNotExist:
+                columns.append(name)
+        return sorted(set(columns))
+
+    def connection_created(self, sender, connection, **kwargs):
+        """ `connection_created` receiver, attaches audit ids on the first connection of any database """
+        if not self._attached:
+            self.attach_audit_ids()
+
+    def attach_audit_ids(self, connection=None):
+        """
+        Add `audit_id` to the models of all currently logged tables, as read
+        from `connection` or else from the database the log is read from
+        """
+        from .models import AuditTableLog, add_audit_id
+
+        with self._lock:
+            # opening the log database's connection sends `connection_created` again,
+            # and another thread may have attached while this one waited for the lock
+            if self._attaching or (self._attached and connection is None):
+                return
+            self._attaching = True
+            try:
+                if connection is None:
+                    connection = connections[router.db_for_read(AuditTableLog)]
+                with connection.cursor() as cursor:
+                    cursor.execute(HAS_AUDIT_LOG)
+                    if not cursor.fetchone()[0]:
+                        return
+                    cursor.execute(AUDITED_TABLES)
+                    tables = set(row[0] for row in cursor.fetchall())
+                for db_table, model in self._candidates.items():
+                    if db_table in tables and model not in self._audited:
+                        add_audit_id(model)
+                        self._audited.add(model)
+                apps.clear_cache()
+                self._attached = True
+            finally:
+                self._attaching = False
+
+    def invalidate(self, **kwargs):
+        """ Drop cached relids, they are reloaded from AuditTableLog on next use """
+        with self._lock:
+            self._by_relid = None
+
+    def _load_relids(self):
+        from .models import AuditTableLog
+        from .routers import use_primary
+
+        # relids are only reloaded for tables the replica may not know of yet
+        with use_primary():
+            return dict(AuditTableLog.objects.values_list('relid', 'table_name'))
+
+    def get_loggable_tables(self):
+        """ Tables of the installed models that `initlogging` logs """
+        return list(self._candidates)
+
+    def get_opted_out_tables(self):
+        """ Tables of installed models that are configured not to be logged """
+        return sorted(self._opted_out)
+
+    def get_excluded_columns(self, db_table):
+        """ Columns of a logged table whose changes alone are not logged """
+        return self._excluded_columns.get(db_table, [])
+
+    def is_audited(self, model):
+        """ Whether the model's table is logged, which also means it has `audit_id` """
+        return model._meta.concrete_model in self._audited
+
+    def get_model_for_table(self, db_table):
+        return self._by_table.get(db_table)
+
+    def get_model_by_name(self, name):
+        """ Look up by `model_name` or `app_label.model_name` (case-insensitive) """
+        return self._by_name.get(name.lower())
+
+    def get_table_for_relid(self, relid):
+        with self._lock:
+            if self._by_relid is None or relid not in self._by_relid:
+                self._by_relid = self._load_relids()
+            return self._by_relid.get(relid)
+
+    def get_model_for_relid(self, relid):
+        db_table = self.get_table_for_relid(relid)
+        if db_table is not None:
+            return self.get_model_for_table(db_table)
+
+
+registry = SubjectRegistry()
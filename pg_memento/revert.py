@@ -0,0 +1,245 @@
+import json
+from collections import OrderedDict
+
+from django.db import connections, transaction, router, ProgrammingError
+
+from .mapping import get_mapper
+from .models import RowLog, RowState
+from .registry import registry
+from .routers import use_primary
+from .schema import schema_history
+
+CHUNK_SIZE = 500
+
+BULK_UPDATE = """
+UPDATE {table} AS t SET {assignments}
+FROM jsonb_populate_recordset(NULL::{table}, %s::jsonb) AS r
+WHERE t.audit_id = r.audit_id
+"""
+
+DEFER_CONSTRAINTS = "SET CONSTRAINTS ALL DEFERRED"
+
+# functions installed from pgMemento's src/REVERT.sql, `tid` is transaction_log.id
+REVERT_TRANSACTION = "SELECT pgmemento.revert_transaction(%s)"
+REVERT_TRANSACTIONS = "SELECT pgmemento.revert_transactions(%s, %s)"
+
+# the revert functions are not installed, or have another signature
+UNDEFINED_FUNCTION = '42883'
+
+
+class RevertResult(object):
+
+    def __init__(self):
+        self.counts = OrderedDict()
+        self.reverted = []
+        self.irrevertable = []
+        self.skipped = []
+        self.backend = 'python'
+
+    def count(self, db_table, operation, number):
+        counts = self.counts.setdefault(db_table, OrderedDict([('deleted', 0), ('updated', 0), ('created', 0)]))
+        counts[operation] += number
+
+
+def fk_order(models):
+    """
+    `models` sorted so that every model comes after the models its foreign keys point to.
+    Models in a cycle keep their given order, deferred constraints take care of those.
+    """
+    models = list(models)
+    parents = {}
+    for model in models:
+        parents[model] = set(
+            field.remote_field.model._meta.concrete_model for field in model._meta.concrete_fields
+            if field.remote_field is not None and (field.many_to_one or field.one_to_one)
+        ).intersection(models) - {model}
+
+    ordered = []
+    remaining = list(models)
+    while remaining:
+        ready = [model for model in remaining if not parents[model].difference(ordered)]
+        if not ready:
+            ready = remaining[:1]
+        for model in ready:
+            ordered.append(model)
+            remaining.remove(model)
+    return ordered
+
+
+class RevertPlan(object):
+    """
+    Set-based revert of a collection of RowLogs.
+
+    RowLogs are grouped by subject table and collapsed per audit_id into the
+    state the row had before the oldest selected change. The plan is then
+    applied with one bulk statement per table and kind of change, in foreign
+    key order: deletes from the referencing tables up, updates and inserts
+    from the referenced tables down. Constraints are deferred to the end of
+    the transaction, for rows that reference each other.
+    """
+
+    def __init__(self, row_logs, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.tables = OrderedDict()
+        self.result = RevertResult()
+        self.build(row_logs)
+
+    def build(self, row_logs):
+        values = row_logs.order_by('-id').values_list('id', 'audit_id', 'changes', 'event__op_id',
+                                                      'event__table_relid_id', 'event__transaction__txid')
+        # a lagging replica could miss the newest changes to revert
+        with use_primary():
+            for row_log_id, audit_id, changes, op_id, relid, txid in values.iterator():
+                model = registry.get_model_for_relid(relid)
+                if model is None or not registry.is_audited(model):
+                    self.result.irrevertable.append(row_log_id)
+                    continue
+                states = self.tables.setdefault(model, OrderedDict())
+                state = states.get(audit_id)
+                if state is None:
+                    state = states[audit_id] = RowState(audit_id)
+                state.fold(op_id, schema_history.translate(relid, txid, changes), row_log_id)
+
+    def apply(self, using=None):
+        with transaction.atomic(using=using):
+            models = fk_order(self.tables)
+            changes = OrderedDict()
+            for model in models:
+                db = using or router.db_for_write(model)
+                with connections[db].cursor() as cursor:
+                    cursor.execute(DEFER_CONSTRAINTS)
+                changes[model] = (db,) + self.partition(model, list(self.tables[model].values()), db)
+
+            for model in reversed(models):
+                db, to_delete, to_update, to_create = changes[model]
+                self.bulk_delete(model, to_delete, db)
+            for model in models:
+                db, to_delete, to_update, to_create = changes[model]
+                self.bulk_update(model, to_update, db)
+                self.bulk_create(model, to_create, db)
+        return self.result
+
+    def partition(self, model, states, using):
+        """ Split the states of a table into rows to delete, to update and to create """
+        to_delete, to_update, to_create = [], [], []
+        for i in range(0, len(states), self.chunk_size):
+            chunk = states[i:i + self.chunk_size]
+            existing = set(model._default_manager.using(using).filter(
+                audit_id__in=[s.audit_id for s in chunk]).values_list('audit_id', flat=True))
+
+            for state in chunk:
+                if not state.exists:
+                    if state.audit_id in existing:
+                        to_delete.append(state)
+                elif state.audit_id in existing:
+                    to_update.append(state)
+                elif state.has_full_row:
+                    to_create.append(state)
+                else:
+                    # updated rows that are gone by now and can't be restored from the selection
+                    self.result.skipped.extend(state.row_log_ids)
+                    continue
+                self.result.reverted.extend(state.row_log_ids)
+        return to_delete, to_update, to_create
+
+    def bulk_delete(self, model, states, using):
+        if states:
+            model._default_manager.using(using).filter(audit_id__in=[s.audit_id for s in states]).delete()
+            self.result.count(model._meta.db_table, 'deleted', len(states))
+
+    def bulk_update(self, model, states, using):
+        """ One UPDATE per distinct set of changed columns, values are cast by postgres """
+        if not states:
+            return
+        columns = get_mapper(model).columns
+        columns.discard('audit_id')
+        groups = OrderedDict()
+        for state in states:
+            changed = tuple(sorted(col for col in state.values if col in columns))
+            if changed:
+                groups.setdefault(changed, []).append(state)
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for changed, group in groups.items():
+                sql = BULK_UPDATE.format(
+                    table=qn(model._meta.db_table),
+                    assignments=', '.join('%s = r.%s' % (qn(col), qn(col)) for col in changed))
+                payload = [dict([(col, s.values[col]) for col in changed], audit_id=s.audit_id) for s in group]
+                cursor.execute(sql, [json.dumps(payload)])
+        self.result.count(model._meta.db_table, 'updated', len(states))
+
+    def bulk_create(self, model, states, using):
+        if states:
+            objs = [model(**values) for values in get_mapper(model).decode_many(s.values for s in states)]
+            model._default_manager.using(using).bulk_create(objs, batch_size=self.chunk_size)
+            self.result.count(model._meta.db_table, 'created', len(states))
+
+
+def revert_row_logs(row_logs, using=None, chunk_size=CHUNK_SIZE):
+    """ Revert a RowLog queryset at once, returns a RevertResult """
+    return RevertPlan(row_logs, chunk_size=chunk_size).apply(using=using)
+
+
+def server_revert(statements, using=None):
+    """
+    Run pgMemento's revert functions in a transaction, returns a RevertResult,
+    or None if the functions are not installed (or have a different signature)
+    """
+    connection = connections[using or router.db_for_write(RowLog)]
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+    except ProgrammingError as e:
+        if getattr(e.__cause__, 'pgcode', None) != UNDEFINED_FUNCTION:
+            raise
+        return None
+    result = RevertResult()
+    result.backend = 'server'
+    return result
+
+
+def revert_transaction_range(start_id, end_id=None, using=None, server=False):
+    """
+    Revert every change made by transactions `start_id`..`end_id` (transaction_log ids).
+
+    The RowLogs are reverted through RevertPlan. With `server`, the work is
+    delegated to pgMemento's revert functions instead, so the rows never
+    leave the database, unless those functions are not installed.
+    """
+    if end_id is None:
+        end_id = start_id
+    if server:
+        if start_id == end_id:
+            result = server_revert([(REVERT_TRANSACTION, [start_id])], using)
+        else:
+            result = server_revert([(REVERT_TRANSACTIONS, [start_id, end_id])], using)
+        if result is not None:
+            return result
+    row_logs = RowLog.objects.filter(event__transaction_id__gte=start_id, event__transaction_id__lte=end_id)
+    if using:
+        row_logs = row_logs.using(using)
+    return revert_row_logs(row_logs, using=using)
+
+
+def revert_transactions(transaction_ids, using=None, server=False):
+    """
+    Revert a selection of transactions (transaction_log ids) in a single database transaction.
+
+    The RowLogs of all the selected transactions are reverted together by
+    one RevertPlan, in foreign key order. With `server`, pgMemento's revert
+    functions are called per transaction, newest first, instead; they know
+    nothing of foreign keys or bulk statements. Returns a RevertResult.
+    """
+    transaction_ids = sorted(transaction_ids, reverse=True)
+    if server:
+        result = server_revert([(REVERT_TRANSACTION, [transaction_id]) for transaction_id in transaction_ids], using)
+        if result is not None:
+            return result
+    row_logs = RowLog.objects.filter(event__transaction_id__in=transaction_ids)
+    if using:
+        row_logs = row_logs.using(using)
+    return revert_row_logs(row_logs, using=using)
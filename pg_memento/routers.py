@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+from .conf import get_read_database, get_max_replica_lag
+
+REPLICA_LAG = "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+
+# how long a replica lag measurement is trusted, in seconds
+LAG_CHECK_INTERVAL = 5
+
+_local = threading.local()
+
+# alias -> (time of the last measurement, whether the replica was stale), shared by all threads
+_lag = {}
+_lag_lock = threading.Lock()
+
+
+@contextmanager
+def use_primary():
+    """ Read the audit log from the primary inside this block, e.g. right before acting on it """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+def replica_is_stale(alias):
+    """
+    Whether `alias` lags more than PG_MEMENTO_READ_MAX_LAG seconds, measured
+    at most every LAG_CHECK_INTERVAL seconds by one thread at a time, while
+    the others go on with the last measurement
+    """
+    max_lag = get_max_replica_lag()
+    if max_lag is None:
+        return False
+    now = time.time()
+    with _lag_lock:
+        checked, stale = _lag.get(alias, (0, False))
+        if now - checked <= LAG_CHECK_INTERVAL:
+            return stale
+        _lag[alias] = (now, stale)
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(REPLICA_LAG)
+            stale = cursor.fetchone()[0] > max_lag
+    except Exception:
+        stale = True
+    with _lag_lock:
+        _lag[alias] = (now, stale)
+    return stale
+
+
+class PgMementoRouter(object):
+    """
+    Sends reads of the pgMemento log models to PG_MEMENTO_READ_DATABASE.
+
+    Writes, including reverts and every write to the logged objects
+    themselves, are left to the default routing. Reads fall back to the
+    primary inside `use_primary()` and while the replica lags more than
+    PG_MEMENTO_READ_MAX_LAG seconds.
+    """
+
+    app_label = 'pg_memento'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        alias = get_read_database()
+        if alias is None or getattr(_local, 'depth', 0) or replica_is_stale(alias):
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == self.app_label and obj2._meta.app_label == self.app_label:
+            return True
+        return None
+
+
+def latest_row_log_id():
+    """ Id of the newest RowLog, always read from the primary """
+    from .models import RowLog
+
+    with use_primary():
+        return RowLog.objects.order_by('-id').values_list('id', flat=True).first()
@@ -0,0 +1,97 @@
+import bisect
+import threading
+
+
+class ColumnHistory(object):
+    """
+    The columns of one table over time, from its AuditColumnLog `txid_range`s.
+
+    The range bounds cut the txid axis into elementary segments, each
+    holding the column names valid within it, so `columns_at` is a binary
+    search. Columns are followed through renames by their ordinal position,
+    which postgres never reuses.
+    """
+
+    def __init__(self, columns):
+        """ `columns`: (column_name, ordinal_position, lower, upper), None bounds are unbounded """
+        columns = list(columns)
+        self.current = dict((ordinal, name) for name, ordinal, lower, upper in columns if upper is None)
+        self.static = all(upper is None for name, ordinal, lower, upper in columns)
+        self.bounds = sorted(set(bound for name, ordinal, lower, upper in columns
+                                 for bound in (lower, upper) if bound is not None))
+        # segment 0 lies before the first bound, segment i + 1 starts at bounds[i]
+        self.segments = [self.valid_at(columns, None)] + [self.valid_at(columns, bound) for bound in self.bounds]
+
+    @staticmethod
+    def valid_at(columns, txid):
+        """ Name -> ordinal of the columns valid at `txid`, None for before any bound """
+        valid = {}
+        for name, ordinal, lower, upper in columns:
+            if txid is None:
+                inside = lower is None
+            else:
+                inside = (lower is None or lower <= txid) and (upper is None or txid < upper)
+            if inside:
+                valid[name] = ordinal
+        return valid
+
+    def columns_at(self, txid):
+        """ Name -> ordinal position of the columns of the table at `txid` """
+        return self.segments[bisect.bisect_right(self.bounds, txid)]
+
+    def translate(self, changes, txid):
+        """
+        `changes` logged at `txid`, keyed by the current column names.
+        Values of columns dropped since are left out; unknown keys are kept.
+        """
+        if self.static or txid is None or not isinstance(changes, dict):
+            return changes
+        valid = self.columns_at(txid)
+        translated = {}
+        for name, value in changes.items():
+            ordinal = valid.get(name)
+            if ordinal is None:
+                translated[name] = value
+            elif ordinal in self.current:
+                translated[self.current[ordinal]] = value
+        return translated
+
+
+class SchemaHistory(object):
+    """ ColumnHistory of every audited table, loaded on first use and dropped on `invalidate()` """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, table_relid):
+        history = self._tables.get(table_relid)
+        if history is None:
+            history = self.load(table_relid)
+            with self._lock:
+                self._tables[table_relid] = history
+        return history
+
+    def load(self, table_relid):
+        from .models import AuditColumnLog
+        from .routers import use_primary
+
+        with use_primary():
+            rows = AuditColumnLog.objects.filter(table_relid=table_relid).values_list(
+                'column_name', 'ordinal_position', 'txid_range')
+            return ColumnHistory((name, ordinal, txid_range.lower if txid_range else None,
+                                  txid_range.upper if txid_range else None)
+                                 for name, ordinal, txid_range in rows)
+
+    def translate(self, table_relid, txid, changes):
+        """ `changes` of a RowLog of transaction `txid` on table `table_relid`, in today's column names """
+        if not isinstance(changes, dict):
+            return changes
+        return self.get(table_relid).translate(changes, txid)
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self._tables = {}
+
+
+schema_history = SchemaHistory()
@@ -0,0 +1,107 @@
+import sys
+
+from django.db import connections, router, transaction, DEFAULT_DB_ALIAS
+from django.utils.decorators import ContextDecorator
+
+from .models import SUSPENDED
+
+# session setting the log triggers check (see initlogging): tables not to log, comma separated
+SUSPEND_SETTING = 'pgmemento.suspend'
+SUSPEND_ALL = '*'
+
+GET_SETTING = "SELECT current_setting(%s, true)"
+
+SET_SETTING = "SELECT set_config(%s, %s, true)"
+
+# rows written to each table in the current transaction so far
+WRITTEN_ROWS = "SELECT relid, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_xact_user_tables"
+
+LOG_TRANSACTION = """
+INSERT INTO pgmemento.transaction_log (txid, stmt_date, user_name, client_name)
+SELECT txid_current(), transaction_timestamp(), current_user, inet_client_addr()::text
+WHERE NOT EXISTS (SELECT 1 FROM pgmemento.transaction_log WHERE txid = txid_current())
+"""
+
+CURRENT_TRANSACTION = "SELECT id FROM pgmemento.transaction_log WHERE txid = txid_current()"
+
+LOG_SUSPENDED_TABLES = """
+WITH event AS (
+    INSERT INTO pgmemento.table_event_log (transaction_id, op_id, table_operation, table_relid)
+    SELECT %s, %s, 'SUSPEND', a.relid FROM pgmemento.audit_table_log a
+    WHERE a.relid = ANY(%s::oid[]) AND upper_inf(a.txid_range) AND (%s OR a.table_name = ANY(%s))
+    RETURNING table_relid
+)
+SELECT a.table_name FROM event JOIN pgmemento.audit_table_log a ON a.relid = event.table_relid
+"""
+
+
+class suspend_logging(ContextDecorator):
+    """
+    Don't log row changes of `models`, or of every table when none are given,
+    written by this connection inside the block. Other connections keep logging.
+
+    The block runs in a transaction (a savepoint when nested) and the
+    suspension ends with it. Instead of the row logs, every logged table
+    that was written to gets one summary event with op_id SUSPENDED, so the
+    suspension itself shows up in the log::
+
+        with suspend_logging(Product, Price):
+            import_prices()
+
+    Relies on the trigger conditions set by `initlogging`.
+    """
+
+    def __init__(self, *models, **kwargs):
+        self.tables = [model._meta.db_table for model in models]
+        self.using = kwargs.pop('using', None)
+        if self.using is None:
+            self.using = router.db_for_write(models[0]) if models else DEFAULT_DB_ALIAS
+        self.affected_tables = []
+        self._stack = []
+
+    def __enter__(self):
+        atomic = transaction.atomic(using=self.using)
+        atomic.__enter__()
+        try:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute(GET_SETTING, [SUSPEND_SETTING])
+                previous = cursor.fetchone()[0] or ''
+                suspended = set(filter(None, previous.split(',')))
+                suspended.update(self.tables or [SUSPEND_ALL])
+                cursor.execute(SET_SETTING, [SUSPEND_SETTING, ','.join(sorted(suspended))])
+                written = self.written_rows(cursor)
+        except Exception:
+            atomic.__exit__(*sys.exc_info())
+            raise
+        self._stack.append((atomic, previous, written))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        atomic, previous, written = self._stack.pop()
+        try:
+            if exc_type is None:
+                with connections[self.using].cursor() as cursor:
+                    self.affected_tables = self.log_summary(cursor, written)
+                    cursor.execute(SET_SETTING, [SUSPEND_SETTING, previous])
+        except Exception:
+            atomic.__exit__(*sys.exc_info())
+            raise
+        return atomic.__exit__(exc_type, exc_value, traceback)
+
+    @staticmethod
+    def written_rows(cursor):
+        cursor.execute(WRITTEN_ROWS)
+        return dict(cursor.fetchall())
+
+    def log_summary(self, cursor, written_before):
+        """ One event per logged table written to since the block started """
+        relids = [relid for relid, count in self.written_rows(cursor).items()
+                  if count > written_before.get(relid, 0)]
+        if not relids:
+            return []
+        cursor.execute(LOG_TRANSACTION)
+        cursor.execute(CURRENT_TRANSACTION)
+        transaction_id = cursor.fetchone()[0]
+        # writes to tables that weren't suspended have been logged as usual
+        cursor.execute(LOG_SUSPENDED_TABLES, [transaction_id, SUSPENDED, relids, not self.tables, self.tables])
+        return sorted(row[0] for row in cursor.fetchall())
@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from pg_memento.models import RowLog, TransactionLog, TableEventLog
+from pg_memento.pagination import EstimatedCountPaginator
+from test_app.models import TestModel
+
+
+class AdminQueryCountTests(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def count_queries(self, url):
+        # warm up per-process caches (registry relids, content types, ...)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_row_log_changelist_query_count_is_constant(self):
+        url = reverse('admin:pg_memento_rowlog_changelist')
+        TestModel.objects.create(name='First', is_good=True)
+        few = self.count_queries(url)
+
+        for i in range(20):
+            TestModel.objects.create(name='Test %d' % i, is_good=bool(i % 2))
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many)
+
+    def test_inlines_query_count_is_constant(self):
+        TestModel.objects.bulk_create([TestModel(name='Bulk %d' % i, is_good=True) for i in range(20)])
+        event = TableEventLog.objects.filter(table_relid__table_name=TestModel._meta.db_table).latest('id')
+        few = self.count_queries(reverse('admin:pg_memento_tableeventlog_change', args=(event.pk,)))
+        TestModel.objects.bulk_create([TestModel(name='Bulk %d' % i, is_good=True) for i in range(40)])
+        event = TableEventLog.objects.filter(table_relid__table_name=TestModel._meta.db_table).latest('id')
+        many = self.count_queries(reverse('admin:pg_memento_tableeventlog_change', args=(event.pk,)))
+        self.assertEqual(few, many)
+
+        transaction = TransactionLog.objects.get(pk=event.transaction_id)
+        self.count_queries(reverse('admin:pg_memento_transactionlog_change', args=(transaction.pk,)))
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        TestModel.objects.bulk_create([TestModel(name='Row %d' % i, is_good=True) for i in range(5)])
+        self.ids = list(RowLog.objects.order_by('-id').values_list('id', flat=True))
+        model_admin = admin.site._registry[RowLog]
+        self.addCleanup(setattr, model_admin, 'list_per_page', model_admin.list_per_page)
+        model_admin.list_per_page = 2
+        self.url = reverse('admin:pg_memento_rowlog_changelist')
+
+    def changelist(self, query=''):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def pks(self, cl):
+        return [row_log.pk for row_log in cl.result_list]
+
+    def test_after_and_before(self):
+        first = self.changelist()
+        self.assertTrue(first.keyset)
+        self.assertEqual(self.pks(first), self.ids[:2])
+        self.assertIsNone(first.prev_cursor)
+
+        second = self.changelist('?after=%d' % first.next_cursor)
+        self.assertEqual(self.pks(second), self.ids[2:4])
+        self.assertEqual(second.prev_cursor, self.ids[2])
+
+        back = self.changelist('?before=%d' % second.prev_cursor)
+        self.assertEqual(self.pks(back), self.ids[:2])
+
+    def test_custom_ordering_falls_back(self):
+        cl = self.changelist('?o=1')
+        self.assertFalse(cl.keyset)
+        self.assertEqual(len(cl.result_list), 2)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    def setUp(self):
+        TestModel.objects.bulk_create([TestModel(name='Row %d' % i, is_good=True) for i in range(5)])
+        self.row_logs = RowLog.objects.filter(event__table_relid__table_name=TestModel._meta.db_table)
+
+    def test_unfiltered_is_estimated(self):
+        paginator = EstimatedCountPaginator(RowLog.objects.all(), 2)
+        self.assertEqual(paginator.count, paginator.estimate_count())
+        self.assertTrue(paginator.estimated)
+
+    def test_filtered_is_exact_below_limit(self):
+        paginator = EstimatedCountPaginator(self.row_logs, 2)
+        self.assertEqual(paginator.count, self.row_logs.count())
+        self.assertFalse(paginator.estimated)
+
+    def test_filtered_is_capped_at_limit(self):
+        paginator = EstimatedCountPaginator(self.row_logs, 2)
+        paginator.exact_count_limit = 3
+        self.assertEqual(paginator.count, 3)
+        self.assertTrue(paginator.estimated)
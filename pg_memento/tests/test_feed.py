@@ -0,0 +1,54 @@
+from __future__ import unicode_literals
+import sys
+from unittest import skipIf
+from django.test import TestCase, TransactionTestCase
+from pg_memento.feed import ChangeFeed, MemoryCheckpoint
+from pg_memento.models import RowLog
+from test_app.models import TestModel, TestTag
+
+
+class ChangeFeedTests(TestCase):
+
+    def test_batches_and_checkpoint(self):
+        start = RowLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        checkpoint = MemoryCheckpoint(start)
+        feed = iter(ChangeFeed(checkpoint, tables=[TestModel._meta.db_table], batch_size=2, timeout=0.01))
+        TestModel.objects.bulk_create([TestModel(name='Bulk %d' % i, is_good=True) for i in range(3)])
+        TestTag.objects.create(name='Not followed')
+
+        first = next(feed)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(all(row_log.id > start for row_log in first))
+        # not consumed until the next batch is asked for
+        self.assertEqual(checkpoint.load(), start)
+
+        second = next(feed)
+        self.assertEqual(checkpoint.load(), first[-1].id)
+        self.assertEqual([row_log.event.table_relid.table_name for row_log in second], [TestModel._meta.db_table])
+        feed.close()
+
+
+@skipIf(sys.version_info < (3, 5), 'pg_memento.aio needs Python 3.5+')
+class AsyncChangeFeedTests(TransactionTestCase):
+    """ The feed queries on a thread of its own, which only sees committed rows """
+
+    def test_batches(self):
+        import asyncio
+        from pg_memento.aio import AsyncChangeFeed
+
+        start = RowLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        checkpoint = MemoryCheckpoint(start)
+        TestModel.objects.bulk_create([TestModel(name='Bulk %d' % i, is_good=True) for i in range(3)])
+        feed = AsyncChangeFeed(checkpoint, tables=[TestModel._meta.db_table], batch_size=2, timeout=0.01)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(loop.close)
+        self.addCleanup(loop.run_until_complete, feed.aclose())
+
+        first = loop.run_until_complete(feed.__anext__())
+        self.assertEqual(len(first), 2)
+        self.assertEqual(checkpoint.load(), start)
+        second = loop.run_until_complete(feed.__anext__())
+        self.assertEqual(len(second), 1)
+        self.assertEqual(checkpoint.load(), first[-1].id)
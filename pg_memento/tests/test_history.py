@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+from django.contrib.auth.models import Group, User
+from django.test import TestCase, override_settings
+from pg_memento.cache import history_cache
+from pg_memento.models import RowLog, HistoryQuerySet, prefetch_history
+from test_app.models import TestModel, TestTag
+
+
+class HistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='someone')
+        self.user.refresh_from_db()
+        self.group = Group.objects.create(name='Group')
+
+    def table_names(self, queryset):
+        return set(queryset.values_list('event__table_relid__table_name', flat=True))
+
+    def test_own_rows(self):
+        history = RowLog.objects.history_of(self.user, include_m2m=False)
+        self.assertEqual(self.table_names(history), {User._meta.db_table})
+
+    def test_current_and_deleted_relations(self):
+        through_table = User.groups.through._meta.db_table
+        self.user.groups.add(self.group)
+        self.assertIn(through_table, self.table_names(RowLog.objects.history_of(self.user)))
+
+        self.user.groups.remove(self.group)
+        history = RowLog.objects.history_of(self.user).filter(event__table_relid__table_name=through_table)
+        self.assertEqual(set(history.values_list('event__op_id', flat=True)), {1, 3})
+
+
+class HistoryCacheTests(TestCase):
+
+    def setUp(self):
+        self.obj = TestModel.objects.create(name='Cached', is_good=True)
+        self.obj.refresh_from_db()
+
+    def test_ids_are_cached_until_the_history_changes(self):
+        ids = history_cache.get_ids(self.obj)
+        self.assertEqual(ids, list(RowLog.objects.history_of(self.obj).values_list('id', flat=True)))
+        # only the newest RowLog id is probed
+        with self.assertNumQueries(1):
+            self.assertEqual(history_cache.get_ids(self.obj), ids)
+
+        TestModel.objects.create(name='Someone else', is_good=True)
+        with self.assertNumQueries(2):
+            self.assertEqual(history_cache.get_ids(self.obj), ids)
+
+        self.obj.name = 'Changed'
+        self.obj.save()
+        self.assertEqual(len(history_cache.get_ids(self.obj)), len(ids) + 1)
+
+    def test_m2m_changes_move_the_version(self):
+        version = history_cache.probe(self.obj)
+        self.assertEqual(history_cache.probe(self.obj, include_m2m=False), version.split('.')[0])
+        self.obj.tags.add(TestTag.objects.create(name='Tag'))
+        self.assertNotEqual(history_cache.probe(self.obj), version)
+        self.assertEqual(history_cache.probe(self.obj, include_m2m=False), version.split('.')[0])
+
+    def test_only_rows_are_cached_for_render(self):
+        template_name = 'manage_view_history.html'
+        queryset = RowLog.objects.history_of(self.obj).select_related('event__table_relid')
+        html = history_cache.render(self.obj, template_name, queryset)
+        version = history_cache.probe(self.obj)
+        self.assertIsNone(history_cache.cache.get(history_cache.key(self.obj, True, version, template_name)))
+        self.assertIsNotNone(history_cache.cache.get(history_cache.key(self.obj, True, version, 'rows')))
+        # only the newest RowLog id is probed, the template is rendered again
+        with self.assertNumQueries(1):
+            self.assertEqual(history_cache.render(self.obj, template_name, queryset), html)
+
+    @override_settings(PG_MEMENTO_HISTORY_CACHE_MAX_ROWS=1)
+    def test_long_histories_are_not_cached(self):
+        self.obj.name = 'Changed'
+        self.obj.save()
+        self.assertIsNone(history_cache.get_ids(self.obj))
+
+
+class PrefetchHistoryTests(TestCase):
+
+    def setUp(self):
+        TestModel.objects.bulk_create([TestModel(name='Object %d' % i, is_good=True) for i in range(3)])
+        self.changed = TestModel.objects.order_by('pk').first()
+        for name in ('Once', 'Twice'):
+            self.changed.name = name
+            self.changed.save()
+
+    def test_newest_row_logs_in_one_query(self):
+        objects = list(TestModel.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            prefetch_history(objects, limit=2)
+            histories = [[row_log.event.transaction.txid for row_log in obj.history] for obj in objects]
+        self.assertEqual([len(history) for history in histories], [2, 1, 1])
+        newest = RowLog.objects.history_of(objects[0], include_m2m=False).order_by('-id')
+        self.assertEqual([row_log.id for row_log in objects[0].history], [row_log.id for row_log in newest[:2]])
+
+    def test_queryset(self):
+        objects = HistoryQuerySet(model=TestModel).order_by('pk').prefetch_history(limit=1)
+        with self.assertNumQueries(2):
+            self.assertTrue(all(len(obj.history) == 1 for obj in objects))
+
+    def test_objects_without_audit_id(self):
+        unsaved = TestModel(name='Unsaved', is_good=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(prefetch_history([unsaved]), [unsaved])
+        self.assertEqual(unsaved.history, [])
@@ -1,7 +1,20 @@
 from __future__ import unicode_literals
-from django.test import TestCase
-from pg_memento.models import RowLog
-from test_app.models import TestModel
+import csv
+import json
+import os
+import tempfile
+from django.core.management import call_command, CommandError
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+from pg_memento.management.commands import _sql
+from pg_memento.management.commands.ensurelogindexes import Command as EnsureLogIndexes
+from pg_memento.management.commands._sql import (set_trigger_condition, update_condition, UPDATE_TRIGGER,
+                                                 init_table, logged_tables, run_locked, uninit_table)
+from pg_memento.models import RowLog, TableEventLog, TransactionLog, SUSPENDED
+from pg_memento.suspend import suspend_logging
+from test_app.models import TestModel, TestTag, WideTestModel
 
 
 class LoggingTests(TestCase):
@@ -10,3 +23,318 @@ class LoggingTests(TestCase):
         self.assertEqual(RowLog.objects.all().count(), 0)
         TestModel.objects.create(name='Test name', is_good=True)
         self.assertGreater(RowLog.objects.all().count(), 0)
+
+
+class ExcludedColumnsTests(TestCase):
+
+    def setUp(self):
+        self.obj = WideTestModel.objects.create(name='Wide')
+        set_trigger_condition(WideTestModel._meta.db_table, UPDATE_TRIGGER, update_condition(['counter', 'updated']),
+                              lock_timeout='2s', retries=0)
+
+    def test_update_of_excluded_columns_only_is_not_logged(self):
+        count = RowLog.objects.count()
+        WideTestModel.objects.filter(pk=self.obj.pk).update(counter=5, updated=timezone.now())
+        self.assertEqual(RowLog.objects.count(), count)
+        WideTestModel.objects.filter(pk=self.obj.pk).update(counter=6, name='Renamed')
+        self.assertEqual(RowLog.objects.count(), count + 1)
+
+    def test_unchanged_condition_is_left_alone(self):
+        self.assertFalse(set_trigger_condition(WideTestModel._meta.db_table, UPDATE_TRIGGER,
+                                               update_condition(['counter', 'updated']),
+                                               lock_timeout='2s', retries=0))
+
+
+class SuspendLoggingTests(TestCase):
+
+    def test_suspended_table_gets_a_summary_event(self):
+        count = RowLog.objects.count()
+        with suspend_logging(TestModel) as suspension:
+            TestModel.objects.bulk_create([TestModel(name='Bulk %d' % i, is_good=True) for i in range(10)])
+            TestModel.objects.update(is_good=False)
+        self.assertEqual(RowLog.objects.count(), count)
+        self.assertEqual(suspension.affected_tables, [TestModel._meta.db_table])
+        self.assertTrue(TableEventLog.objects.filter(
+            op_id=SUSPENDED, table_relid__table_name=TestModel._meta.db_table).exists())
+
+        TestModel.objects.create(name='Logged again', is_good=True)
+        self.assertGreater(RowLog.objects.count(), count)
+
+    def test_other_tables_keep_logging(self):
+        count = RowLog.objects.count()
+        with suspend_logging(TestModel):
+            TestModel.objects.create(name='Not logged', is_good=True)
+            TestTag.objects.create(name='Logged')
+        self.assertEqual(RowLog.objects.count(), count + 1)
+        self.assertFalse(TableEventLog.objects.filter(
+            op_id=SUSPENDED, table_relid__table_name=TestTag._meta.db_table).exists())
+
+    def test_decorator_suspends_every_table(self):
+        @suspend_logging()
+        def load():
+            TestModel.objects.create(name='Not logged', is_good=True)
+            TestTag.objects.create(name='Not logged')
+
+        count = RowLog.objects.count()
+        load()
+        self.assertEqual(RowLog.objects.count(), count)
+
+
+class ExportLogTests(TestCase):
+
+    def setUp(self):
+        TestModel.objects.create(name='Exported', is_good=True)
+        TestTag.objects.create(name='Exported')
+
+    def export(self, **options):
+        stdout = StringIO()
+        call_command('exportlog', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.export(batch_size=1).splitlines()]
+        self.assertEqual(len(rows), RowLog.objects.count())
+        self.assertEqual([row['id'] for row in rows], sorted(RowLog.objects.values_list('id', flat=True)))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export(format='csv', tables=[TestTag._meta.db_table]))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['table_name'], TestTag._meta.db_table)
+
+    def test_output_file(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.assertEqual(self.export(output=path), '')
+        with open(path) as output:
+            self.assertEqual(len(output.readlines()), RowLog.objects.count())
+
+
+class PartitionLogTests(TestCase):
+
+    def setUp(self):
+        TestModel.objects.create(name='Before', is_good=True)
+
+    def partitionlog(self, **options):
+        stdout = StringIO()
+        call_command('partitionlog', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def fetch(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def test_dry_run_prints_the_conversion(self):
+        output = self.partitionlog('row_log', convert=True, dry_run=True, premake=1)
+        self.assertIn('UPDATE pgmemento.row_log r SET stmt_date = t.stmt_date', output)
+        self.assertIn('PRIMARY KEY (id, stmt_date)) PARTITION BY RANGE (stmt_date)', output)
+        self.assertIn('ATTACH PARTITION pgmemento.row_log_legacy FOR VALUES FROM (MINVALUE)', output)
+        self.assertIn('PARTITION OF pgmemento.row_log FOR VALUES FROM', output)
+        self.assertNotIn('table_event_log', output)
+        self.assertFalse(self.fetch("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                                    "WHERE partrelid = 'pgmemento.row_log'::regclass)")[0][0])
+
+    def test_convert(self):
+        indexes = "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = 'pgmemento.row_log'::regclass " \
+                  "AND NOT indisprimary"
+        original_indexes = set(self.fetch(indexes))
+        self.partitionlog('row_log', convert=True, premake=1)
+
+        partitions = self.fetch("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                "WHERE i.inhparent = 'pgmemento.row_log'::regclass ORDER BY c.relname")
+        self.assertEqual(partitions[0][0], 'row_log_legacy')
+        self.assertGreater(len(partitions), 1)
+        self.assertEqual(set(self.fetch(indexes)), original_indexes)
+
+        # old rows are dated by their transaction
+        transaction = TransactionLog.objects.latest('id')
+        self.assertEqual(self.fetch("SELECT DISTINCT stmt_date FROM pgmemento.row_log"), [(transaction.stmt_date,)])
+
+        # later statements of the transaction that logged `Before` are logged to the same transaction
+        TestModel.objects.create(name='After', is_good=True)
+        TestModel.objects.filter(name='After').update(is_good=False)
+        self.assertEqual(TransactionLog.objects.filter(txid=transaction.txid).count(), 1)
+        self.assertEqual(RowLog.objects.filter(event__transaction=transaction,
+                                               event__table_relid__table_name=TestModel._meta.db_table).count(), 3)
+
+    def test_unique_index_without_partition_key_is_refused(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE UNIQUE INDEX row_log_unique_test ON pgmemento.row_log (id, event_id)')
+        with self.assertRaisesMessage(CommandError, 'row_log: row_log_unique_test'):
+            self.partitionlog(convert=True, premake=1)
+        self.assertFalse(self.fetch("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                                    "WHERE partrelid = 'pgmemento.row_log'::regclass)")[0][0])
+
+
+class EnsureLogIndexesTests(TransactionTestCase):
+    """ CREATE INDEX CONCURRENTLY can't run in the transaction of a TestCase """
+
+    index = 'table_event_log_table_relid_idx'
+
+    def setUp(self):
+        TestModel.objects.create(name='Indexed', is_good=True)
+
+    def ensurelogindexes(self, **options):
+        stdout = StringIO()
+        call_command('ensurelogindexes', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def is_valid(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+                           ['pgmemento.%s' % self.index])
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def test_dry_run(self):
+        self.execute('DROP INDEX IF EXISTS pgmemento.%s' % self.index)
+        output = self.ensurelogindexes(dry_run=True)
+        self.assertIn('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON pgmemento.table_event_log '
+                      'USING btree (table_relid, id)' % self.index, output)
+        for name in ('object history', 'history version', 'state deltas'):
+            self.assertIn('-- %s (before)' % name, output)
+        self.assertNotIn('(after)', output)
+        self.assertIsNone(self.is_valid())
+
+    def test_missing_index_is_created(self):
+        self.execute('DROP INDEX IF EXISTS pgmemento.%s' % self.index)
+        output = self.ensurelogindexes()
+        self.assertTrue(self.is_valid())
+        self.assertIn('-- history version (after)', output)
+
+    def test_existing_indexes_are_kept(self):
+        self.ensurelogindexes()
+        output = self.ensurelogindexes()
+        self.assertIn('All indexes are in place.', output)
+        self.assertNotIn('CREATE INDEX', output)
+
+    def test_invalid_index_is_rebuilt(self):
+        self.ensurelogindexes()
+        # as left behind by an interrupted CREATE INDEX CONCURRENTLY
+        self.execute("UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'pgmemento.%s'::regclass" % self.index)
+        output = self.ensurelogindexes()
+        self.assertIn('DROP INDEX CONCURRENTLY IF EXISTS pgmemento.%s' % self.index, output)
+        self.assertTrue(self.is_valid())
+
+    def test_operator_class_must_match(self):
+        definition = 'CREATE INDEX row_log_changes ON pgmemento.row_log USING gin (changes%s)'
+        self.assertFalse(EnsureLogIndexes.serves('gin', definition % '', 'gin', 'changes jsonb_path_ops'))
+        self.assertTrue(EnsureLogIndexes.serves('gin', definition % ' jsonb_path_ops', 'gin', 'changes jsonb_path_ops'))
+        definition = 'CREATE INDEX row_log_audit ON pgmemento.row_log USING btree (%s)'
+        self.assertFalse(EnsureLogIndexes.serves('btree', definition % 'audit_id', 'btree', 'audit_id, id'))
+        self.assertTrue(EnsureLogIndexes.serves('btree', definition % 'audit_id, id', 'btree', 'audit_id, id'))
+
+
+class InitLoggingTests(TestCase):
+
+    def setUp(self):
+        self.table = TestTag._meta.db_table
+
+    def initlogging(self, **options):
+        stdout = StringIO()
+        call_command('initlogging', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def fetch(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def test_nothing_to_change(self):
+        output = self.initlogging()
+        self.assertIn('default: public', output)
+        self.assertIn('Nothing to change.', output)
+
+    def test_dry_run(self):
+        uninit_table(self.table, '2s', 0)
+        output = self.initlogging(dry_run=True)
+        self.assertIn('+ %s' % self.table, output)
+        self.assertNotIn(self.table, logged_tables())
+
+    def test_adds_missing_tables(self):
+        uninit_table(self.table, '2s', 0)
+        self.assertIn('+ %s' % self.table, self.initlogging())
+        self.assertIn(self.table, logged_tables())
+
+        count = RowLog.objects.count()
+        TestTag.objects.create(name='Logged again')
+        self.assertEqual(RowLog.objects.count(), count + 1)
+
+    def test_drops_ignored_tables(self):
+        with override_settings(PG_MEMENTO_IGNORE_TABLES=[self.table]):
+            self.assertIn('- %s' % self.table, self.initlogging())
+        self.assertNotIn(self.table, logged_tables())
+
+    def test_tables_without_model(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE removed_model (id serial PRIMARY KEY)')
+        init_table('removed_model', '2s', 0)
+
+        self.assertIn('? removed_model', self.initlogging())
+        self.assertIn('removed_model', logged_tables())
+        self.assertIn('- removed_model', self.initlogging(prune=True))
+        self.assertNotIn('removed_model', logged_tables())
+
+    def test_full(self):
+        self.initlogging(full=True)
+        self.assertIn(self.table, logged_tables())
+        # the suspend conditions are set again on the recreated triggers
+        count = RowLog.objects.count()
+        with suspend_logging(TestTag):
+            TestTag.objects.create(name='Not logged')
+        self.assertEqual(RowLog.objects.count(), count)
+
+    def test_schemas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE SCHEMA other')
+            cursor.execute('CREATE TABLE other.%s (LIKE public.%s INCLUDING DEFAULTS)' % (self.table, self.table))
+        with override_settings(PG_MEMENTO_SCHEMAS={'default': ['public', 'other']}):
+            output = self.initlogging()
+        self.assertIn('default: other', output)
+        self.assertEqual(logged_tables('other'), {self.table})
+
+    def test_databases(self):
+        with override_settings(PG_MEMENTO_DATABASES=['default']):
+            self.assertIn('default: public', self.initlogging())
+        with self.assertRaises(CommandError):
+            self.initlogging(databases=['no_such_database'])
+
+    def test_notify_trigger(self):
+        trigger = ("SELECT count(*) FROM pg_trigger WHERE tgrelid = 'pgmemento.table_event_log'::regclass "
+                   "AND tgname = 'notify_transaction_trigger'")
+        with override_settings(PG_MEMENTO_NOTIFY='changes'):
+            self.initlogging()
+        self.assertEqual(self.fetch(trigger), [(1,)])
+        self.assertIn("'changes'", self.fetch(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgname = 'notify_transaction_trigger'")[0][0])
+
+        self.initlogging()
+        self.assertEqual(self.fetch(trigger), [(0,)])
+
+
+class RunLockedTests(TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.addCleanup(setattr, _sql.time, 'sleep', _sql.time.sleep)
+        _sql.time.sleep = self.sleeps.append
+        # another session holds the table
+        self.other = connection.get_new_connection(connection.get_connection_params())
+        self.addCleanup(self.other.close)
+        with self.other.cursor() as cursor:
+            cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % TestTag._meta.db_table)
+
+    def test_lock_timeout_is_retried(self):
+        statements = [('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % TestTag._meta.db_table, None)]
+        with self.assertRaises(OperationalError):
+            run_locked(statements, '50ms', retries=2)
+        self.assertEqual(self.sleeps, [1.0, 2.0])
+
+    def test_other_tables_are_not_waited_for(self):
+        run_locked([('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % TestModel._meta.db_table, None)], '50ms', retries=2)
+        self.assertEqual(self.sleeps, [])
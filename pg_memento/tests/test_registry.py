@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from pg_memento.models import AuditTableLog
+from pg_memento.registry import registry, SubjectRegistry
+from test_app.models import TestModel, TestTag, WideTestModel
+
+
+class RegistryTests(TestCase):
+
+    def test_model_for_table(self):
+        self.assertIs(registry.get_model_for_table(TestModel._meta.db_table), TestModel)
+        self.assertIsNone(registry.get_model_for_table('no_such_table'))
+
+    def test_model_by_name(self):
+        self.assertIs(registry.get_model_by_name('TestModel'), TestModel)
+        self.assertIs(registry.get_model_by_name('test_app.testmodel'), TestModel)
+
+    def test_model_for_relid(self):
+        table_log = AuditTableLog.objects.get(table_name=TestModel._meta.db_table)
+        self.assertIs(registry.get_model_for_relid(table_log.relid), TestModel)
+        with self.assertNumQueries(0):
+            registry.get_model_for_relid(table_log.relid)
+
+
+class AttachAuditIdTests(TestCase):
+
+    def test_logged_models_have_audit_id(self):
+        # the tests never add audit_id by hand, the registry attached it after initlogging
+        for model in (TestModel, TestTag, TestModel.tags.through, User):
+            self.assertTrue(registry.is_audited(model))
+            model._meta.get_field('audit_id')
+
+    def test_audit_id_is_a_column(self):
+        field = TestModel._meta.get_field('audit_id')
+        self.assertEqual((field.name, field.column), ('audit_id', 'audit_id'))
+        self.assertFalse(field.editable)
+        obj = TestModel.objects.create()
+        self.assertIsNotNone(TestModel.objects.get(pk=obj.pk).audit_id)
+        self.assertTrue(TestModel.objects.filter(audit_id=TestModel.objects.get(pk=obj.pk).audit_id).exists())
+
+    def test_audit_id_not_in_migrations(self):
+        from django.db.migrations.state import ModelState
+        self.assertNotIn('audit_id', dict(ModelState.from_model(TestModel).fields))
+
+    def test_attached_on_connection_created(self):
+        subjects = SubjectRegistry()
+        subjects.populate()
+        self.assertFalse(subjects.is_audited(TestModel))
+
+        subjects.connection_created(sender=connection.__class__, connection=connection)
+        self.assertTrue(subjects.is_audited(TestModel))
+        self.assertFalse(subjects.is_audited(AuditTableLog))
+
+        # only the first connection attaches
+        with self.assertNumQueries(0):
+            subjects.connection_created(sender=connection.__class__, connection=connection)
+
+    def test_attached_on_connection_of_any_alias(self):
+        subjects = SubjectRegistry()
+        subjects.populate()
+
+        class WriteConnection(object):
+            alias = 'write_only'
+
+        # the log is read through the log's read alias, whichever connection came first
+        subjects.connection_created(sender=None, connection=WriteConnection())
+        self.assertTrue(subjects.is_audited(TestModel))
+
+    def test_not_attached_before_install(self):
+        subjects = SubjectRegistry()
+        subjects.populate()
+
+        class Cursor(object):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def execute(self, sql, params=None):
+                pass
+
+            def fetchone(self):
+                return (False,)
+
+        class Uninstalled(object):
+            alias = 'default'
+
+            def cursor(self):
+                return Cursor()
+
+        subjects.attach_audit_ids(Uninstalled())
+        self.assertFalse(subjects._attached)
+        # the next connection checks again, and finds the log
+        subjects.connection_created(sender=connection.__class__, connection=connection)
+        self.assertTrue(subjects.is_audited(TestModel))
+
+
+class ModelOptionsTests(TestCase):
+
+    def populate(self):
+        subjects = SubjectRegistry()
+        subjects.populate()
+        return subjects
+
+    @override_settings(PG_MEMENTO_MODELS={
+        'test_app.WideTestModel': {'exclude_columns': ['counter', 'updated']},
+        'test_app.testtag': {'log': False},
+    })
+    def test_settings(self):
+        subjects = self.populate()
+        self.assertEqual(subjects.get_excluded_columns(WideTestModel._meta.db_table), ['counter', 'updated'])
+        self.assertEqual(subjects.get_excluded_columns(TestModel._meta.db_table), [])
+        self.assertIn(TestTag._meta.db_table, subjects.get_opted_out_tables())
+        self.assertNotIn(TestTag._meta.db_table, subjects.get_loggable_tables())
+
+    @override_settings(PG_MEMENTO_OPT_IN=True, PG_MEMENTO_MODELS={'test_app.testmodel': {'log': True}})
+    def test_opt_in(self):
+        subjects = self.populate()
+        self.assertIn(TestModel._meta.db_table, subjects.get_loggable_tables())
+        # the m2m table follows the model that declares it
+        self.assertIn(TestModel.tags.through._meta.db_table, subjects.get_loggable_tables())
+        self.assertIn(WideTestModel._meta.db_table, subjects.get_opted_out_tables())
@@ -0,0 +1,215 @@
+from __future__ import unicode_literals
+import datetime
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+from pg_memento.mapping import get_mapper
+from pg_memento.models import RowLog, TransactionLog
+from pg_memento.registry import registry
+from pg_memento.revert import fk_order, revert_row_logs, revert_transaction_range, revert_transactions
+from pg_memento.schema import ColumnHistory
+from test_app.models import TestModel, TestTag, WideTestModel
+
+
+class BulkRevertTests(TestCase):
+
+    def setUp(self):
+        self.obj = TestModel.objects.create(name='Original', is_good=True)
+        self.obj.refresh_from_db()
+
+    def row_logs(self):
+        return RowLog.objects.filter(event__table_relid__table_name=TestModel._meta.db_table,
+                                     audit_id=self.obj.audit_id)
+
+    def test_revert_updates_collapse(self):
+        inserted = self.row_logs().values_list('id', flat=True)
+        TestModel.objects.filter(pk=self.obj.pk).update(name='First')
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Second', is_good=False)
+
+        result = revert_row_logs(self.row_logs().exclude(id__in=list(inserted)))
+
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.name, 'Original')
+        self.assertTrue(self.obj.is_good)
+        self.assertEqual(result.counts[TestModel._meta.db_table]['updated'], 1)
+
+    def test_revert_insert_deletes(self):
+        revert_row_logs(self.row_logs())
+        self.assertFalse(TestModel.objects.filter(pk=self.obj.pk).exists())
+
+    def test_revert_delete_restores(self):
+        TestModel.objects.filter(pk=self.obj.pk).delete()
+        revert_row_logs(self.row_logs().filter(event__op_id=3))
+        self.assertEqual(TestModel.objects.get(pk=self.obj.pk).name, 'Original')
+
+    def test_unaudited_model_is_irrevertable(self):
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Changed')
+        registry._audited.discard(TestModel)
+        self.addCleanup(registry._audited.add, TestModel)
+
+        result = revert_row_logs(self.row_logs())
+
+        self.assertEqual(sorted(result.irrevertable), sorted(self.row_logs().values_list('id', flat=True)))
+        self.assertEqual(TestModel.objects.get(pk=self.obj.pk).name, 'Changed')
+
+
+class TransactionRevertTests(TestCase):
+
+    def test_fk_order(self):
+        through = TestModel.tags.through
+        ordered = fk_order([through, TestModel, TestTag])
+        self.assertEqual(ordered[-1], through)
+        self.assertEqual(set(ordered[:2]), {TestModel, TestTag})
+
+    def test_revert_parent_and_children(self):
+        obj = TestModel.objects.create(name='Tagged', is_good=True)
+        obj.tags.add(TestTag.objects.create(name='Tag'))
+
+        result = revert_transactions([TransactionLog.objects.latest('id').id])
+
+        self.assertEqual(result.backend, 'python')
+        self.assertFalse(TestModel.objects.filter(pk=obj.pk).exists())
+        self.assertFalse(TestModel.tags.through.objects.filter(testmodel_id=obj.pk).exists())
+        self.assertFalse(TestTag.objects.filter(name='Tag').exists())
+        self.assertEqual(result.counts[TestModel.tags.through._meta.db_table]['deleted'], 1)
+
+
+class ServerRevertTests(TransactionTestCase):
+    """ pgMemento's revert functions, which need transactions committed before the ones reverted """
+
+    def test_revert_transaction_range(self):
+        updated = TestModel.objects.create(name='Original', is_good=True)
+        deleted = TestModel.objects.create(name='Deleted', is_good=True)
+        start = TransactionLog.objects.latest('id').id + 1
+
+        TestModel.objects.filter(pk=updated.pk).update(name='Changed')
+        TestModel.objects.filter(pk=deleted.pk).delete()
+        created = TestModel.objects.create(name='Created', is_good=False)
+        end = TransactionLog.objects.latest('id').id
+
+        result = revert_transaction_range(start, end, server=True)
+
+        self.assertEqual(result.backend, 'server')
+        self.assertEqual(TestModel.objects.get(pk=updated.pk).name, 'Original')
+        self.assertEqual(TestModel.objects.get(pk=deleted.pk).name, 'Deleted')
+        self.assertFalse(TestModel.objects.filter(pk=created.pk).exists())
+
+
+class StateOfTests(TransactionTestCase):
+    """ The changes after `as_of` have to be committed in transactions of their own """
+
+    def setUp(self):
+        self.obj = TestModel.objects.create(name='Original', is_good=True)
+        self.obj.refresh_from_db()
+        self.as_of = TransactionLog.objects.latest('id').txid
+
+    def test_state_of_updated(self):
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Changed')
+        state = RowLog.objects.state_of(self.obj, as_of=self.as_of)
+        self.assertEqual(state.name, 'Original')
+        self.assertEqual(TestModel.objects.get(pk=self.obj.pk).name, 'Changed')
+
+    def test_state_of_deleted(self):
+        TestModel.objects.filter(pk=self.obj.pk).delete()
+        state = RowLog.objects.state_of(TestModel, as_of=self.as_of, audit_id=self.obj.audit_id)
+        self.assertEqual(state.pk, self.obj.pk)
+        self.assertEqual(state.name, 'Original')
+
+    def test_states_of_inserted_later(self):
+        later = TestModel.objects.create(name='Later', is_good=False)
+        later.refresh_from_db()
+        states = RowLog.objects.states_of(TestModel, [self.obj.audit_id, later.audit_id], as_of=self.as_of)
+        self.assertEqual(states[self.obj.audit_id].name, 'Original')
+        self.assertIsNone(states[later.audit_id])
+
+
+class SnapshotTests(TransactionTestCase):
+    """ The changes after the snapshot have to be committed in transactions of their own """
+
+    def setUp(self):
+        self.obj = TestModel.objects.create(name='Original', is_good=True)
+        self.obj.refresh_from_db()
+        self.as_of = TransactionLog.objects.latest('id').txid
+        self.addCleanup(self.drop_snapshot)
+
+    def drop_snapshot(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS snapshot CASCADE')
+
+    def snapshot(self, **options):
+        call_command('snapshotlog', TestModel._meta.db_table, txid=self.as_of, schema='snapshot', jobs=1,
+                     replace=True, stdout=StringIO(), **options)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT audit_id, name FROM snapshot.%s ORDER BY audit_id'
+                           % connection.ops.quote_name(TestModel._meta.db_table))
+            return cursor.fetchall()
+
+    def test_snapshot_updated(self):
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Changed')
+        TestModel.objects.create(name='Later', is_good=False)
+        self.assertEqual(self.snapshot(), [(self.obj.audit_id, 'Original')])
+        self.assertEqual(TestModel.objects.get(pk=self.obj.pk).name, 'Changed')
+
+    def test_snapshot_deleted(self):
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Changed')
+        TestModel.objects.filter(pk=self.obj.pk).delete()
+        self.assertEqual(self.snapshot(), [(self.obj.audit_id, 'Original')])
+
+    def test_snapshot_pgmemento(self):
+        TestModel.objects.filter(pk=self.obj.pk).update(name='Changed')
+        TestModel.objects.create(name='Later', is_good=False)
+        self.assertEqual(self.snapshot(pgmemento=True), [(self.obj.audit_id, 'Original')])
+        self.assertEqual(self.snapshot(), self.snapshot(pgmemento=True))
+
+
+class ColumnMapperTests(TestCase):
+
+    def test_values_are_converted(self):
+        obj = WideTestModel.objects.create(name='Wide', amount=Decimal('12.50'), day=datetime.date(2016, 7, 1),
+                                           created=timezone.now())
+        obj.delete()
+        row_log = RowLog.objects.filter(event__table_relid__table_name=WideTestModel._meta.db_table,
+                                        event__op_id=3).latest('id')
+
+        values = get_mapper(WideTestModel).decode(row_log.changes)
+        self.assertEqual(values['amount'], Decimal('12.50'))
+        self.assertEqual(values['day'], datetime.date(2016, 7, 1))
+        self.assertIsInstance(values['created'], datetime.datetime)
+
+        row_log.revert()
+        self.assertEqual(WideTestModel.objects.get(pk=obj.pk).amount, Decimal('12.50'))
+
+    def test_foreign_key_columns(self):
+        through = TestModel.tags.through
+        self.assertEqual(get_mapper(through).decode({'testmodel_id': 1, 'unknown': 2}), {'testmodel_id': 1})
+
+
+class ColumnHistoryTests(SimpleTestCase):
+
+    def setUp(self):
+        # "name" was renamed to "title" at txid 100, "old" dropped at 200, "extra" added at 150
+        self.history = ColumnHistory([
+            ('id', 1, None, None),
+            ('name', 2, None, 100),
+            ('title', 2, 100, None),
+            ('old', 3, None, 200),
+            ('extra', 4, 150, None),
+        ])
+
+    def test_columns_at(self):
+        self.assertEqual(self.history.columns_at(50), {'id': 1, 'name': 2, 'old': 3})
+        self.assertEqual(self.history.columns_at(100), {'id': 1, 'title': 2, 'old': 3})
+        self.assertEqual(self.history.columns_at(199), {'id': 1, 'title': 2, 'old': 3, 'extra': 4})
+        self.assertEqual(self.history.columns_at(200), {'id': 1, 'title': 2, 'extra': 4})
+
+    def test_translate(self):
+        self.assertEqual(self.history.translate({'id': 1, 'name': 'A', 'old': 'x'}, 50), {'id': 1, 'title': 'A'})
+        self.assertEqual(self.history.translate({'title': 'B', 'unknown': 2}, 120), {'title': 'B', 'unknown': 2})
+
+    def test_static_table(self):
+        history = ColumnHistory([('id', 1, None, None), ('name', 2, 10, None)])
+        changes = {'name': 'A'}
+        self.assertIs(history.translate(changes, 5), changes)
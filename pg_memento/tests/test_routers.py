@@ -0,0 +1,68 @@
+from __future__ import unicode_literals
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from pg_memento.models import RowLog
+from pg_memento import routers
+from pg_memento.routers import PgMementoRouter, replica_is_stale, use_primary
+from test_app.models import TestModel
+
+
+@override_settings(PG_MEMENTO_READ_DATABASE='replica')
+class RouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PgMementoRouter()
+
+    def test_log_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(RowLog), 'replica')
+        self.assertIsNone(self.router.db_for_write(RowLog))
+
+    def test_other_models_are_left_alone(self):
+        self.assertIsNone(self.router.db_for_read(TestModel))
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertIsNone(self.router.db_for_read(RowLog))
+        self.assertEqual(self.router.db_for_read(RowLog), 'replica')
+
+
+# the test database stands in for the replica, its lag is always 0
+@override_settings(PG_MEMENTO_READ_DATABASE='default')
+class ReplicaLagTests(TestCase):
+
+    def setUp(self):
+        self.router = PgMementoRouter()
+        routers._lag.clear()
+        self.addCleanup(routers._lag.clear)
+
+    def expire_measurements(self):
+        self.addCleanup(setattr, routers, 'LAG_CHECK_INTERVAL', routers.LAG_CHECK_INTERVAL)
+        routers.LAG_CHECK_INTERVAL = -1
+
+    @override_settings(PG_MEMENTO_READ_MAX_LAG=-1)
+    def test_stale_replica_routes_to_primary(self):
+        self.assertIsNone(self.router.db_for_read(RowLog))
+
+    @override_settings(PG_MEMENTO_READ_MAX_LAG=10)
+    def test_current_replica(self):
+        self.assertEqual(self.router.db_for_read(RowLog), 'default')
+
+    def test_lag_is_measured_once_per_interval(self):
+        with self.settings(PG_MEMENTO_READ_MAX_LAG=-1):
+            with self.assertNumQueries(1):
+                self.assertTrue(replica_is_stale('default'))
+        with self.settings(PG_MEMENTO_READ_MAX_LAG=10):
+            with self.assertNumQueries(0):
+                self.assertTrue(replica_is_stale('default'))
+            self.expire_measurements()
+            with self.assertNumQueries(1):
+                self.assertFalse(replica_is_stale('default'))
+
+    @override_settings(PG_MEMENTO_READ_MAX_LAG=-1)
+    def test_measured_per_alias(self):
+        self.assertTrue(replica_is_stale(connection.alias))
+        self.assertEqual(list(routers._lag), [connection.alias])
+        # an alias that can't be reached counts as stale
+        self.assertTrue(replica_is_stale('no_such_database'))
+        self.assertEqual(sorted(routers._lag), sorted([connection.alias, 'no_such_database']))
@@ -1,10 +1,26 @@
 import os
+import sys
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+# modules that only parse on Python 3.5+ (async/await)
+PY35_MODULES = [('pg_memento', 'aio')]
 
 
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+
+class BuildPy(build_py):
+    """ Leaves the Python 3.5+ modules out of installs on older versions """
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [module for module in modules if module[:2] not in PY35_MODULES]
+        return modules
+
+
 setup(
     name='django-pgMemento',
     version='0.1.0',
@@ -35,4 +51,5 @@ setup(
     ],
     zip_safe=False,
     test_suite='testrunner',
+    cmdclass={'build_py': BuildPy},
 )
@@ -0,0 +1,69 @@
+"""
+Benchmarks against a local PostgreSQL, run through `benchmark.py` at the
+repository root. Every scenario reports machine-readable results, so runs
+of different releases can be compared.
+"""
+from __future__ import division
+
+import platform
+from contextlib import contextmanager
+from timeit import default_timer
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class Timer(object):
+    """ Collects the duration of every measured operation of a scenario """
+
+    def __init__(self):
+        self.durations = []
+        self.queries = []
+
+    @contextmanager
+    def measure(self, count_queries=False):
+        if count_queries:
+            with CaptureQueriesContext(connection) as context:
+                start = default_timer()
+                yield
+                self.durations.append(default_timer() - start)
+            self.queries.append(len(context.captured_queries))
+        else:
+            start = default_timer()
+            yield
+            self.durations.append(default_timer() - start)
+
+    def percentile(self, fraction):
+        durations = sorted(self.durations)
+        return durations[min(int(len(durations) * fraction), len(durations) - 1)]
+
+    def result(self, **info):
+        total = sum(self.durations)
+        result = dict(info)
+        result.update({
+            'operations': len(self.durations),
+            'seconds': total,
+            'latency_ms': {
+                'mean': total / len(self.durations) * 1000,
+                'p50': self.percentile(0.5) * 1000,
+                'p95': self.percentile(0.95) * 1000,
+                'max': max(self.durations) * 1000,
+            },
+        })
+        if 'rows' in info:
+            result['rows_per_second'] = info['rows'] / total if total else None
+        if self.queries:
+            result['queries'] = max(self.queries)
+        return result
+
+
+def environment():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW server_version')
+        server_version = cursor.fetchone()[0]
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'postgresql': server_version,
+    }
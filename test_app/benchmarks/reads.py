@@ -0,0 +1,103 @@
+"""
+Latency and query counts of the log read paths, as the log grows.
+
+The log is filled with `generatelog` up to every size in turn, so scaling
+problems show up as timings or query counts that grow with the log.
+"""
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.utils.six import StringIO
+
+from pg_memento.models import RowLog
+from pg_memento.revert import revert_row_logs
+from test_app.models import TestModel
+from . import Timer
+
+ANALYZE = "ANALYZE pgmemento.transaction_log, pgmemento.table_event_log, pgmemento.row_log"
+
+REVERTED_ROWS = 100
+
+
+def get_client():
+    user_model = get_user_model()
+    user = user_model.objects.filter(username='benchmark').first()
+    if user is None:
+        user = user_model.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def fill_log(size, **options):
+    """ Add synthetic row logs until there are `size` of them """
+    missing = size - RowLog.objects.count()
+    if missing > 0:
+        call_command('generatelog', rows=missing, stdout=StringIO(), **options)
+    with connection.cursor() as cursor:
+        cursor.execute(ANALYZE)
+
+
+def get_scenarios(client):
+    """ (name, callable) for every read path, against the hottest and the coldest object """
+    changelist = reverse('admin:pg_memento_rowlog_changelist')
+    model_admin = admin.site._registry[TestModel]
+    hot = TestModel.objects.order_by('pk').first()
+    cold = TestModel.objects.order_by('-pk').first()
+    middle = RowLog.objects.order_by('-id').values_list('id', flat=True).first() // 2
+
+    def get(url, **params):
+        def view():
+            response = client.get(url, params)
+            assert response.status_code == 200, response.status_code
+        return view
+
+    def row_logs(obj):
+        return lambda: list(model_admin.get_row_logs(obj))
+
+    def rolled_back(func):
+        def view():
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+        return view
+
+    latest = RowLog.objects.history_of(hot, include_m2m=False).order_by('-id').first()
+    recent = RowLog.objects.filter(event__table_relid__table_name=TestModel._meta.db_table).order_by('-id')
+    recent_ids = list(recent.values_list('id', flat=True)[:REVERTED_ROWS])
+
+    scenarios = [
+        ('changelist', get(changelist)),
+        ('changelist_deep_page', get(changelist, after=middle)),
+        ('changelist_object_hot', get(changelist, model='testmodel', object_id=hot.pk)),
+        ('changelist_object_cold', get(changelist, model='testmodel', object_id=cold.pk)),
+        ('get_row_logs_hot', row_logs(hot)),
+        ('get_row_logs_cold', row_logs(cold)),
+        ('manage_view_hot', get(reverse('admin:test_app_testmodel_manage', args=(hot.pk,)))),
+        ('revert_rows_%d' % REVERTED_ROWS,
+         rolled_back(lambda: revert_row_logs(RowLog.objects.filter(pk__in=recent_ids)))),
+    ]
+    if latest is not None:
+        scenarios.append(('row_log_revert', rolled_back(lambda: RowLog.objects.get(pk=latest.pk).revert())))
+    return scenarios
+
+
+def run(sizes, repeat=3, match=None, **options):
+    results = []
+    client = get_client()
+    for size in sorted(sizes):
+        fill_log(size, **options)
+        for name, view in get_scenarios(client):
+            if match and match not in name:
+                continue
+            # the first call warms per-process caches, as in a long running server
+            view()
+            timer = Timer()
+            for attempt in range(repeat):
+                with timer.measure(count_queries=True):
+                    view()
+            results.append(timer.result(scenario=name, log_size=size))
+    return results
@@ -0,0 +1,123 @@
+"""
+Write throughput and latency, with pgMemento's row triggers on and off.
+"""
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.utils import timezone
+
+from test_app.models import TestModel, TestTag, WideTestModel
+from . import Timer
+
+
+def narrow(i):
+    return TestModel(name='Narrow %d' % i, is_good=bool(i % 2))
+
+
+def wide(i):
+    now = timezone.now()
+    return WideTestModel(name='Wide %d' % i, description='A somewhat longer description %d' % i,
+                         counter=i, amount=i, ratio=i / 3.0, created=now, updated=now, day=now.date(),
+                         code='code-%d' % i, email='user%d@example.com' % i, url='http://example.com/%d' % i,
+                         slug='slug-%d' % i, text_1='one', text_2='two', text_3='three',
+                         number_1=i, number_2=i * 2, number_3=i * 3)
+
+
+MODELS = (
+    ('narrow', TestModel, narrow),
+    ('wide', WideTestModel, wide),
+)
+
+
+def single_save(model, factory, rows, timer):
+    for i in range(rows):
+        with timer.measure():
+            factory(i).save()
+
+
+def single_update(model, factory, rows, timer):
+    model.objects.bulk_create([factory(i) for i in range(rows)])
+    for obj in model.objects.all():
+        obj.name = obj.name + ' changed'
+        with timer.measure():
+            obj.save()
+
+
+def single_delete(model, factory, rows, timer):
+    model.objects.bulk_create([factory(i) for i in range(rows)])
+    for obj in model.objects.all():
+        with timer.measure():
+            obj.delete()
+
+
+def bulk_create(model, factory, rows, timer):
+    objs = [factory(i) for i in range(rows)]
+    with timer.measure():
+        model.objects.bulk_create(objs)
+
+
+def queryset_update(model, factory, rows, timer):
+    model.objects.bulk_create([factory(i) for i in range(rows)])
+    with timer.measure():
+        model.objects.update(name='Updated')
+
+
+def queryset_delete(model, factory, rows, timer):
+    model.objects.bulk_create([factory(i) for i in range(rows)])
+    with timer.measure():
+        model.objects.all().delete()
+
+
+SCENARIOS = (
+    ('save', single_save),
+    ('update', single_update),
+    ('delete', single_delete),
+    ('bulk_create', bulk_create),
+    ('queryset_update', queryset_update),
+    ('queryset_delete', queryset_delete),
+)
+
+
+def m2m_changes(rows, timer):
+    """ Add, then remove, a tag per object one by one """
+    TestModel.objects.bulk_create([narrow(i) for i in range(rows)])
+    tag = TestTag.objects.create(name='Tag')
+    objs = list(TestModel.objects.all())
+    for obj in objs:
+        with timer.measure():
+            obj.tags.add(tag)
+    for obj in objs:
+        with timer.measure():
+            obj.tags.remove(tag)
+
+
+def cleanup():
+    TestModel.tags.through.objects.all().delete()
+    for model in (TestModel, TestTag, WideTestModel):
+        model.objects.all().delete()
+
+
+def set_logging(enabled):
+    call_command('initlogging' if enabled else 'uninitlogging', stdout=StringIO())
+
+
+def run(rows, repeat=1, match=None):
+    results = []
+    for logging in (False, True):
+        set_logging(logging)
+        for attempt in range(repeat):
+            cases = [('%s_%s' % (scenario, width), func, model, factory)
+                     for width, model, factory in MODELS for scenario, func in SCENARIOS]
+            for name, func, model, factory in cases:
+                if match and match not in name:
+                    continue
+                cleanup()
+                timer = Timer()
+                func(model, factory, rows, timer)
+                results.append(timer.result(scenario=name, logging=logging, rows=rows, run=attempt))
+            if not match or match in 'm2m':
+                cleanup()
+                timer = Timer()
+                m2m_changes(rows, timer)
+                results.append(timer.result(scenario='m2m', logging=logging, rows=rows * 2, run=attempt))
+    cleanup()
+    return results
@@ -0,0 +1,181 @@
+from __future__ import division
+
+import datetime
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from pg_memento.registry import registry
+from test_app.benchmarks.writes import narrow, wide
+from test_app.models import TestModel, TestTag, WideTestModel
+
+CURRENT_RELID = """
+SELECT relid FROM pgmemento.audit_table_log WHERE table_name = %s AND upper_inf(txid_range)
+"""
+
+# synthetic transactions are put before every logged one, so repeated runs keep txid and time in order
+LOG_START = """
+SELECT least(min(txid), txid_current()), least(min(stmt_date), now()) FROM pgmemento.transaction_log
+"""
+
+HAS_PARTITION_KEY = """
+SELECT EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = 'pgmemento' AND table_name = 'row_log' AND column_name = 'stmt_date')
+"""
+
+TRANSACTIONS = """
+WITH tx AS (
+    INSERT INTO pgmemento.transaction_log (txid, stmt_date, user_name, client_name)
+    SELECT %(first_txid)s + g, %(first_date)s + g * %(step)s, 'generatelog', NULL
+    FROM generate_series(0, %(transactions)s - 1) g
+    RETURNING id
+)"""
+
+# `power(random(), skew)` piles the picks up at the start of the array, the hot objects
+PICK = "(%(ids)s::bigint[])[1 + floor(%(count)s * power(random(), %(skew)s))::int]"
+
+UPDATES = TRANSACTIONS + """, ev AS (
+    INSERT INTO pgmemento.table_event_log (transaction_id, op_id, table_operation, table_relid)
+    SELECT id, 2, 'UPDATE', %(relid)s FROM tx
+    RETURNING id
+)
+INSERT INTO pgmemento.row_log (event_id, audit_id, changes)
+SELECT ev.id, {pick}, {changes}
+FROM ev, generate_series(1, %(rows_per_transaction)s)
+""".format(pick=PICK, changes='{changes}')
+
+# a relation added and removed again: the INSERT is logged without changes, the DELETE with the full row
+M2M_CHURN = TRANSACTIONS + """, ins AS (
+    INSERT INTO pgmemento.table_event_log (transaction_id, op_id, table_operation, table_relid)
+    SELECT id, 1, 'INSERT', %(relid)s FROM tx
+    RETURNING id, transaction_id
+), del AS (
+    INSERT INTO pgmemento.table_event_log (transaction_id, op_id, table_operation, table_relid)
+    SELECT id, 3, 'DELETE', %(relid)s FROM tx
+    RETURNING id, transaction_id
+), rel AS (
+    SELECT ins.id AS insert_id, del.id AS delete_id, nextval('pgmemento.audit_id_seq') AS audit_id,
+           {pick} AS object_id,
+           (%(tag_ids)s::bigint[])[1 + floor(%(tags)s * random())::int] AS tag_id
+    FROM ins JOIN del USING (transaction_id)
+)
+INSERT INTO pgmemento.row_log (event_id, audit_id, changes)
+SELECT insert_id, audit_id, NULL FROM rel
+UNION ALL
+SELECT delete_id, audit_id, jsonb_build_object('id', audit_id, %(column)s, object_id,
+                                               %(reverse_column)s, tag_id, 'audit_id', audit_id)
+FROM rel
+""".format(pick=PICK)
+
+CHANGES = {
+    TestModel: "jsonb_build_object('name', md5(random()::text))",
+    WideTestModel: "jsonb_build_object('name', md5(random()::text), 'counter', floor(random() * 1000)::int, "
+                   "'text_1', md5(random()::text))",
+}
+
+
+class Command(BaseCommand):
+    help = ('Fill the pgMemento log with synthetic history of the test_app models, '
+            'for benchmarking the read paths at realistic log sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', dest='rows', type=int, default=1000000,
+                            help='row logs to add')
+        parser.add_argument('--objects', dest='objects', type=int, default=10000,
+                            help='objects of each model the history is about, created if missing')
+        parser.add_argument('--tags', dest='tags', type=int, default=100)
+        parser.add_argument('--skew', dest='skew', type=float, default=3.0,
+                            help='1 spreads changes evenly, higher values concentrate them on fewer hot objects')
+        parser.add_argument('--m2m', dest='m2m', type=float, default=0.2,
+                            help='share of the row logs that come from adding and removing tags')
+        parser.add_argument('--rows-per-transaction', dest='rows_per_transaction', type=int, default=3)
+        parser.add_argument('--days', dest='days', type=int, default=365,
+                            help='time span the added transactions are spread over')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=100000,
+                            help='row logs inserted per database transaction')
+        parser.add_argument('--database', dest='database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['rows'] <= 0:
+            raise CommandError('--rows has to be positive')
+        self.connection = connections[options['database']]
+        for model in (TestModel, WideTestModel, TestModel.tags.through):
+            if not registry.is_audited(model):
+                raise CommandError('%s is not logged, run initlogging first' % model._meta.db_table)
+        if self.fetch(HAS_PARTITION_KEY)[0][0]:
+            raise CommandError('The log is partitioned, generate it before running partitionlog --convert')
+
+        using = self.connection.alias
+        self.create_objects(TestModel, narrow, options['objects'])
+        self.create_objects(WideTestModel, wide, options['objects'])
+        self.create_objects(TestTag, lambda i: TestTag(name='Tag %d' % i), options['tags'])
+        audit_ids = dict((model, list(model.objects.using(using).order_by('pk').values_list(
+            'audit_id', flat=True)[:options['objects']])) for model in (TestModel, WideTestModel))
+        object_ids = list(TestModel.objects.using(using).order_by('pk').values_list('pk', flat=True)[
+            :options['objects']])
+        tag_ids = list(TestTag.objects.using(using).values_list('pk', flat=True))
+
+        batches = self.plan(options)
+        total = sum(sum(counts) for counts in batches)
+        first_txid, first_date = self.fetch(LOG_START)[0]
+        first_txid -= total
+        step = datetime.timedelta(days=options['days']) / total
+        first_date -= step * total
+
+        through = TestModel.tags.through
+        field = TestModel._meta.get_field('tags')
+        skew = options['skew']
+        written = 0
+        start = default_timer()
+        for narrow_count, wide_count, churn_count in batches:
+            with transaction.atomic(using=using):
+                for model, count in ((TestModel, narrow_count), (WideTestModel, wide_count)):
+                    self.execute(UPDATES.format(changes=CHANGES[model]), count, first_txid, first_date, step,
+                                 relid=self.relid(model), ids=audit_ids[model], count=len(audit_ids[model]),
+                                 skew=skew, rows_per_transaction=options['rows_per_transaction'])
+                    first_txid += count
+                    first_date += step * count
+                    written += count * options['rows_per_transaction']
+                self.execute(M2M_CHURN, churn_count, first_txid, first_date, step,
+                             relid=self.relid(through), ids=object_ids, count=len(object_ids), skew=skew,
+                             tag_ids=tag_ids, tags=len(tag_ids),
+                             column=field.m2m_column_name(), reverse_column=field.m2m_reverse_name())
+                first_txid += churn_count
+                first_date += step * churn_count
+                written += churn_count * 2
+            self.stdout.write('%d row logs, %.0f rows/s' % (written, written / (default_timer() - start)))
+        self.stdout.write(self.style.SUCCESS('Done!'))
+
+    def fetch(self, sql, params=None):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def relid(self, model):
+        return self.fetch(CURRENT_RELID, [model._meta.db_table])[0][0]
+
+    def create_objects(self, model, factory, count):
+        manager = model.objects.using(self.connection.alias)
+        existing = manager.count()
+        if existing < count:
+            manager.bulk_create([factory(i) for i in range(existing, count)], batch_size=1000)
+
+    def plan(self, options):
+        """ Transactions per batch: (narrow updates, wide updates, m2m churn) """
+        batches = []
+        rows = options['rows']
+        while rows > 0:
+            batch_rows = min(rows, options['batch_size'])
+            churn = int(batch_rows * options['m2m'] / 2)
+            updates = max((batch_rows - churn * 2) // options['rows_per_transaction'], 1)
+            batches.append((updates - updates // 2, updates // 2, churn))
+            rows -= batch_rows
+        return batches
+
+    def execute(self, sql, transactions, first_txid, first_date, step, **params):
+        if transactions <= 0:
+            return
+        params.update(transactions=transactions, first_txid=first_txid, first_date=first_date, step=step)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WideTestModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+                ('description', models.TextField(blank=True)),
+                ('is_good', models.BooleanField(default=False)),
+                ('counter', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('ratio', models.FloatField(default=0)),
+                ('created', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+                ('day', models.DateField(blank=True, null=True)),
+                ('code', models.CharField(blank=True, max_length=32)),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('url', models.URLField(blank=True)),
+                ('slug', models.SlugField(blank=True)),
+                ('text_1', models.TextField(blank=True)),
+                ('text_2', models.TextField(blank=True)),
+                ('text_3', models.TextField(blank=True)),
+                ('number_1', models.BigIntegerField(default=0)),
+                ('number_2', models.BigIntegerField(default=0)),
+                ('number_3', models.BigIntegerField(default=0)),
+                ('flag_1', models.BooleanField(default=False)),
+                ('flag_2', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testmodel',
+            name='tags',
+            field=models.ManyToManyField(blank=True, to='test_app.TestTag'),
+        ),
+    ]
@@ -5,6 +5,44 @@ class TestModel(models.Model):
 
     name = models.TextField()
     is_good = models.BooleanField()
+    tags = models.ManyToManyField('TestTag', blank=True)
+
+    class Meta:
+        app_label = 'test_app'
+
+
+class TestTag(models.Model):
+
+    name = models.TextField()
+
+    class Meta:
+        app_label = 'test_app'
+
+
+class WideTestModel(models.Model):
+    """ A wide row, to compare trigger overhead against the narrow TestModel """
+
+    name = models.TextField()
+    description = models.TextField(blank=True)
+    is_good = models.BooleanField(default=False)
+    counter = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ratio = models.FloatField(default=0)
+    created = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(null=True, blank=True)
+    day = models.DateField(null=True, blank=True)
+    code = models.CharField(max_length=32, blank=True)
+    email = models.EmailField(blank=True)
+    url = models.URLField(blank=True)
+    slug = models.SlugField(blank=True)
+    text_1 = models.TextField(blank=True)
+    text_2 = models.TextField(blank=True)
+    text_3 = models.TextField(blank=True)
+    number_1 = models.BigIntegerField(default=0)
+    number_2 = models.BigIntegerField(default=0)
+    number_3 = models.BigIntegerField(default=0)
+    flag_1 = models.BooleanField(default=False)
+    flag_2 = models.BooleanField(default=False)
 
     class Meta:
         app_label = 'test_app'